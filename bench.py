@@ -0,0 +1,274 @@
+#!/bin/env python3
+
+import argparse
+import contextlib
+import datetime
+import io
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# Hash to hold module level data
+resources = {}
+
+HERE = pathlib.Path( __file__ ).resolve().parent
+
+
+def get_args():
+    if 'args' not in resources:
+        parser = argparse.ArgumentParser( description='triage scheduler benchmarks' )
+        parser.add_argument( 'benchmarks', nargs='*', default=[ 'startup' ],
+                help=f'Benchmarks to run: {", ".join( BENCHMARKS )} (default: startup).',
+            )
+        parser.add_argument( '-r', '--repeat', type=int, default=10,
+                help='Number of runs per measurement (default: 10).',
+            )
+        parser.add_argument( '--latency', type=float, default=0,
+                help='Seconds added to each fake calendar call in "modes" and "pipeline" (default: 0).',
+            )
+        resources['args'] = parser.parse_args()
+    return resources['args']
+
+
+def mk_staff_file( dirname, count=30 ):
+    ''' Write a staff CSV with count staff and two managers, return the path
+    '''
+    path = pathlib.Path( dirname ) / 'staff.csv'
+    lines = [ 'Name,Email,Type,DOW' ]
+    lines.extend( f'Staff{i:02d},staff{i:02d}@example.com,staff,' for i in range( count ) )
+    lines.append( 'Mgr1,mgr1@example.com,manager,MTW' )
+    lines.append( 'Mgr2,mgr2@example.com,manager,RF' )
+    path.write_text( '\n'.join( lines ) + '\n' )
+    return path
+
+
+def time_command( cmd, env, repeat ):
+    ''' Run cmd "repeat" times, return list of wall times in seconds
+    '''
+    times = []
+    for _ in range( repeat ):
+        t0 = time.perf_counter()
+        subprocess.run( cmd, env=env, check=True, stdout=subprocess.DEVNULL )
+        times.append( time.perf_counter() - t0 )
+    return times
+
+
+def report( name, times ):
+    print( f'{name:<32} min {min(times)*1000:7.1f} ms   median {statistics.median(times)*1000:7.1f} ms' )
+
+
+def bench_startup():
+    ''' Wall time of offline commands, which must not import pandas or exchangelib
+    '''
+    repeat = get_args().repeat
+    with tempfile.TemporaryDirectory() as tmpdir:
+        env = dict( os.environ, TRIAGE_STAFF_FILE=str( mk_staff_file( tmpdir ) ) )
+        run_py = str( HERE / 'run.py' )
+        report( 'python (baseline)', time_command( [ sys.executable, '-c', 'pass' ], env, repeat ) )
+        report( 'run.py --help', time_command( [ sys.executable, run_py, '--help' ], env, repeat ) )
+        report( 'run.py --list_teams', time_command( [ sys.executable, run_py, '--list_teams' ], env, repeat ) )
+        check = (
+            'import sys; sys.argv = [ "run.py", "--list_teams" ]; import run; run.run(); '
+            'heavy = [ m for m in ( "pandas", "exchangelib" ) if m in sys.modules ]; '
+            'sys.exit( f"heavy modules imported: {heavy}" if heavy else 0 )'
+        )
+        subprocess.run( [ sys.executable, '-c', check ], env=env, cwd=HERE, check=True, stdout=subprocess.DEVNULL )
+        print( 'OK: --list_teams imports neither pandas nor exchangelib' )
+
+
+# Start date of the "modes" benchmark (a Monday) and the ranges it covers
+MODES_START = datetime.date( 2027, 1, 4 )
+MODES_RANGES = (
+    ( '1 month', 30 ),
+    ( '1 year', 365 ),
+    ( '5 years', 5 * 365 ),
+)
+MODES = ( '--mktriage', '--mkhandoff', '--triage_report' )
+
+
+def mk_fake_calendar( start, end, latency ):
+    ''' FakeBackend with TRIAGE events for the first half of the workdays
+        from start to end, and HANDOFF events for the first quarter
+        (every fifth one with the wrong attendees)
+    '''
+    import libbackend
+    import libdate
+    import libgroup
+    import run
+    backend = libbackend.FakeBackend( run.get_regex_map(), latency=latency, seed=1 )
+    staff = run.get_staff()
+    teams = libgroup.FairTeams( list( staff.keys() ) )
+    workdays = libdate.get_workdays( start, end )
+    half = len( workdays ) // 2
+    prev = None
+    for i, day in enumerate( workdays[ :half ] ):
+        members = teams[i]
+        emails = [ staff[name].Email for name in members ]
+        backend.add_event( day, f"Triage: {', '.join( members )}", emails )
+        if prev and i < half // 2:
+            handoff = prev + emails + [ m.Email for m in run.get_MODs( day ) ]
+            if i % 5 == 0:
+                handoff = handoff[ 1: ]
+            start_at = datetime.datetime.combine( day, datetime.time( hour=8, minute=45 ) )
+            backend.add_event( start_at, 'Triage Hand-Off', handoff )
+        prev = emails
+    # calls made while setting up don't count
+    backend.calls.clear()
+    return backend
+
+
+def run_mode( argv, backend=None ):
+    ''' Run run.py in this process with the given arguments and calendar
+        (backend=None: the one selected by argv)
+    '''
+    import run
+    run.resources.clear()
+    if backend is not None:
+        run.resources['backend'] = backend
+    sys.argv = [ 'run.py' ] + argv
+    with contextlib.redirect_stdout( io.StringIO() ):
+        run.run()
+
+
+def setup_env( tmp ):
+    ''' Input files and cache location for running run.py in directory tmp
+    '''
+    ( tmp / 'holidays.csv' ).write_text( 'date\n' )
+    ( tmp / 'location' ).write_text( 'https://example.com/triage\n' )
+    os.environ.update(
+        TRIAGE_STAFF_FILE = str( mk_staff_file( tmp ) ),
+        TRIAGE_HOLIDAYS_FILE = str( tmp / 'holidays.csv' ),
+        TRIAGE_LOCATION_FILE = str( tmp / 'location' ),
+        TRIAGE_CACHE_FILE = str( tmp / 'cache' / 'events.json' ),
+    )
+
+
+def clear_hashes( tmp ):
+    ''' Forget the event hashes of earlier runs (see run.get_hash_store())
+    '''
+    for path in ( tmp / 'cache' ).glob( 'hashes*.json' ):
+        path.unlink()
+
+
+def bench_modes():
+    ''' Wall time, calendar calls and peak memory of --mktriage, --mkhandoff
+        and --triage_report over each range in MODES_RANGES, against a
+        pre-populated in-memory calendar (libbackend.FakeBackend)
+    '''
+    import run
+    args = get_args()
+    saved_argv = sys.argv
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp = pathlib.Path( tmpdir )
+        setup_env( tmp )
+        print( f'{"mode":<16} {"range":<8} {"min":>10} {"median":>10} {"peak":>9}  calls' )
+        for range_name, days in MODES_RANGES:
+            start = MODES_START
+            end = start + datetime.timedelta( days=days - 1 )
+            argv = [ '--start', str( start ), '--end', str( end ), '--no_cache', '--fetch_window', 'YS' ]
+            # staff file and work calendar are read by run.py
+            run.resources.clear()
+            sys.argv = [ 'run.py' ] + argv
+            for mode in MODES:
+                times = []
+                for _ in range( args.repeat ):
+                    clear_hashes( tmp )
+                    backend = mk_fake_calendar( start, end, args.latency )
+                    t0 = time.perf_counter()
+                    run_mode( [ mode ] + argv, backend )
+                    times.append( time.perf_counter() - t0 )
+                # separate run for memory, tracemalloc slows everything down
+                clear_hashes( tmp )
+                backend = mk_fake_calendar( start, end, args.latency )
+                tracemalloc.start()
+                run_mode( [ mode ] + argv, backend )
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                calls = ' '.join( f'{k}={v}' for k, v in sorted( backend.calls.items() ) )
+                print(
+                    f'{mode:<16} {range_name:<8} {min(times)*1000:7.1f} ms {statistics.median(times)*1000:7.1f} ms '
+                    f'{peak/2**20:6.1f} MB  {calls}'
+                )
+    sys.argv = saved_argv
+
+
+def bench_pipeline():
+    ''' Wall time of --mktriage --mkhandoff over each range in MODES_RANGES,
+        one stage after the other and with --pipeline, against the same
+        pre-populated in-memory calendar as "modes"
+    '''
+    args = get_args()
+    saved_argv = sys.argv
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp = pathlib.Path( tmpdir )
+        setup_env( tmp )
+        print( f'{"range":<8} {"sequential":>12} {"pipeline":>12}' )
+        for range_name, days in MODES_RANGES:
+            end = MODES_START + datetime.timedelta( days=days - 1 )
+            argv = [ '--mktriage', '--mkhandoff', '--start', str( MODES_START ), '--end', str( end ), '--no_cache' ]
+            medians = []
+            for extra in ( [], [ '--pipeline' ] ):
+                times = []
+                for _ in range( args.repeat ):
+                    clear_hashes( tmp )
+                    sys.argv = [ 'run.py' ] + argv
+                    backend = mk_fake_calendar( MODES_START, end, args.latency )
+                    t0 = time.perf_counter()
+                    run_mode( argv + extra, backend )
+                    times.append( time.perf_counter() - t0 )
+                medians.append( statistics.median( times ) )
+            print( f'{range_name:<8} {medians[0]*1000:9.1f} ms {medians[1]*1000:9.1f} ms' )
+    sys.argv = saved_argv
+
+
+def bench_ics():
+    ''' Wall time of writing triage and handoff events for each range in
+        MODES_RANGES to a new .ics file (--backend ics), and of reading
+        them back with --triage_report
+    '''
+    args = get_args()
+    saved_argv = sys.argv
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp = pathlib.Path( tmpdir )
+        setup_env( tmp )
+        ics = tmp / 'calendar.ics'
+        print( f'{"range":<8} {"events":>6} {"size":>9} {"write":>10} {"read":>10}' )
+        for range_name, days in MODES_RANGES:
+            end = MODES_START + datetime.timedelta( days=days - 1 )
+            argv = [ '--start', str( MODES_START ), '--end', str( end ), '--no_cache',
+                     '--backend', 'ics', '--ics_file', str( ics ) ]
+            write_times = []
+            read_times = []
+            for _ in range( args.repeat ):
+                ics.unlink( missing_ok=True )
+                clear_hashes( tmp )
+                t0 = time.perf_counter()
+                run_mode( [ '--mktriage', '--mkhandoff' ] + argv )
+                write_times.append( time.perf_counter() - t0 )
+                t0 = time.perf_counter()
+                run_mode( [ '--triage_report', '--report_format', 'jsonl' ] + argv )
+                read_times.append( time.perf_counter() - t0 )
+            events = ics.read_text().count( 'BEGIN:VEVENT' )
+            print(
+                f'{range_name:<8} {events:>6} {ics.stat().st_size/2**10:6.0f} KB '
+                f'{statistics.median(write_times)*1000:7.1f} ms {statistics.median(read_times)*1000:7.1f} ms'
+            )
+    sys.argv = saved_argv
+
+
+BENCHMARKS = {
+    'startup': bench_startup,
+    'modes': bench_modes,
+    'pipeline': bench_pipeline,
+    'ics': bench_ics,
+}
+
+
+if __name__ == '__main__':
+    for name in get_args().benchmarks:
+        BENCHMARKS[ name ]()
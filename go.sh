@@ -76,5 +76,6 @@ docker run --rm -it --pull always \
   --mount type=bind,src=$HOME,dst=/home \
   -e OAUTH_CONFIG_FILE='/home/.ssh/exchange_oauth.yaml' \
   -e OAUTH_TOKEN_FILE='/home/.ssh/exchange_token' \
+  -e TRIAGE_CACHE_FILE='/home/.cache/asd-triage-scheduler/events.json' \
   "${DOCKER_ENVS[@]}" \
   $REGISTRY/$OWNER/$REPO:$tag
@@ -0,0 +1,355 @@
+#!/bin/env python3
+
+import bisect
+import collections
+import itertools
+import os
+import pathlib
+import random
+import threading
+import time
+import uuid
+
+import libics
+import libstore
+
+
+class Backend( object ):
+    ''' Calendar access used by run.py.
+        Events are exchanged as libstore.EventRecords and changes as ops (see libplan).
+    '''
+
+    def fetch( self, start, end ):
+        ''' TRIAGE and HANDOFF events between start and end (naive local datetimes)
+            Return list of libstore.EventRecords
+        '''
+        raise NotImplementedError
+
+    def sync( self, sync_state ):
+        ''' All TRIAGE and HANDOFF changes since sync_state (everything if None)
+            Raise libstore.SyncStateExpired if sync_state is no longer valid.
+            Return ( changes, new_sync_state ) where changes is a list of
+            ( item_id, libstore.EventRecord ) for created or updated events
+            and ( item_id, None ) for removed events
+        '''
+        raise NotImplementedError
+
+    def execute( self, op ):
+        ''' Send a single create or update op
+            Return ( item_id, changekey ) if known, else None
+        '''
+        raise NotImplementedError
+
+    def write_batch( self, ops ):
+        ''' Send several create and update ops in bulk requests
+            Raise if a whole request fails.
+            Return list of ( op, result ) where result is either
+            an ( item_id, changekey ) tuple or an exception instance
+        '''
+        raise NotImplementedError
+
+    def set_max_connections( self, count ):
+        ''' Prepare for up to count calls in parallel
+        '''
+        pass
+
+    def flush( self ):
+        ''' Make sure all changes so far are saved (called after applying a plan)
+        '''
+        pass
+
+    def throttle_errors( self ):
+        ''' Tuple of exception classes meaning "slow down and retry"
+        '''
+        return ()
+
+
+class PyExchBackend( Backend ):
+    ''' Exchange calendar through pyexch (https://github.com/andylytical/pyexch)
+        pyexch and exchangelib are imported on first use.
+    '''
+
+    def __init__( self, regex_map ):
+        self.regex_map = regex_map
+        self.regexes = libstore.compile_regex_map( regex_map )
+        self._px = None
+        self.lock = threading.Lock()
+
+    @property
+    def px( self ):
+        with self.lock:
+            if self._px is None:
+                import pyexch.pyexch
+                self._px = pyexch.pyexch.PyExch( regex_map = self.regex_map )
+            return self._px
+
+    def fetch( self, start, end ):
+        import libexch
+        return libexch.fetch_records( self.px, start, end, self.regexes )
+
+    def sync( self, sync_state ):
+        import libexch
+        return libexch.sync_records( self.px, sync_state, self.regexes )
+
+    def execute( self, op ):
+        import libexch
+        if op['action'] == 'update':
+            return libexch.update_item( self.px, op )
+        return libexch.create_item( self.px, op )
+
+    def write_batch( self, ops ):
+        import libexch
+        return libexch.bulk_write( self.px, ops )
+
+    def set_max_connections( self, count ):
+        import libexch
+        libexch.set_max_connections( self.px, count )
+
+    def throttle_errors( self ):
+        import libpool
+        return libpool.throttle_errors()
+
+
+class FakeError( Exception ):
+    ''' Injected failure
+    '''
+    pass
+
+
+class FakeThrottled( Exception ):
+    ''' Injected "server busy" response
+    '''
+    back_off = 0.01
+
+
+class FakeBackend( Backend ):
+    ''' In-memory calendar for offline runs, tests and benchmarks.
+        Also provides the PyExch methods used by the scheduler
+        (get_events_filtered, new_all_day_event, new_event, update_event).
+        latency = seconds added to every call
+        failure_rate = probability that a call raises FakeError
+        throttle_rate = probability that a call raises FakeThrottled
+    '''
+
+    def __init__( self, regex_map, latency=0, failure_rate=0, throttle_rate=0, seed=None ):
+        self.regexes = libstore.compile_regex_map( regex_map )
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.random = random.Random( seed )
+        self.calls = collections.Counter()
+        self.events = {}
+        # item_id of every change in order, sync states are positions in this list
+        self.changelog = []
+        self.ids = itertools.count( 1 )
+        self.lock = threading.Lock()
+
+    def _call( self, name ):
+        ''' Count the call, then apply latency and injected failures
+        '''
+        with self.lock:
+            self.calls[name] += 1
+            roll = self.random.random()
+        if self.latency:
+            time.sleep( self.latency )
+        if roll < self.throttle_rate:
+            raise FakeThrottled( f'{name}: server busy (injected)' )
+        if roll < self.throttle_rate + self.failure_rate:
+            raise FakeError( f'{name}: failed (injected)' )
+
+    def _store( self, record ):
+        with self.lock:
+            if not record.item_id:
+                record.item_id = f'fake-{next( self.ids )}'
+            record.changekey = f'ck-{len( self.changelog ) + 1}'
+            self.events[ record.item_id ] = record
+            self.changelog.append( record.item_id )
+        return ( record.item_id, record.changekey )
+
+    def add_event( self, start, subject, attendees ):
+        ''' Pre-populate the calendar (not counted as a call)
+            Return the new libstore.EventRecord
+        '''
+        record = libstore.EventRecord(
+            start = start,
+            typ = libstore.classify( self.regexes, subject ),
+            subject = subject,
+            attendees = attendees,
+        )
+        self._store( record )
+        return record
+
+    def delete_event( self, item_id ):
+        with self.lock:
+            del self.events[ item_id ]
+            self.changelog.append( item_id )
+
+    # PyExch methods
+
+    def get_events_filtered( self, start, end ):
+        self._call( 'get_events_filtered' )
+        with self.lock:
+            found = [ e for e in self.events.values() if e.type and start <= e.start <= end ]
+        return sorted( found, key=lambda e: e.start )
+
+    def new_all_day_event( self, date, subject, attendees, location, categories, free=False ):
+        self._call( 'new_all_day_event' )
+        return self.add_event( date, subject, attendees )
+
+    def new_event( self, start, end, subject, attendees, location, categories ):
+        self._call( 'new_event' )
+        return self.add_event( start, subject, attendees )
+
+    def update_event( self, event, attendees ):
+        ''' event = libstore.EventRecord (or anything with an item_id)
+        '''
+        self._call( 'update_event' )
+        with self.lock:
+            record = self.events[ event.item_id ]
+        record.attendees = tuple( attendees )
+        return self._store( record )
+
+    # Backend interface
+
+    def fetch( self, start, end ):
+        return [ copy_record( e ) for e in self.get_events_filtered( start, end ) ]
+
+    def sync( self, sync_state ):
+        self._call( 'sync' )
+        with self.lock:
+            seq = int( sync_state or 0 )
+            if seq > len( self.changelog ):
+                raise libstore.SyncStateExpired( sync_state )
+            changed = dict.fromkeys( self.changelog[seq:] )
+            changes = []
+            for item_id in changed:
+                e = self.events.get( item_id )
+                changes.append( ( item_id, copy_record( e ) if e and e.type else None ) )
+            return ( changes, str( len( self.changelog ) ) )
+
+    def execute( self, op ):
+        if op['action'] == 'update':
+            return self.update_event( op['event'], op['attendees'] )
+        if op['all_day']:
+            record = self.new_all_day_event(
+                op['start'], op['subject'], op['attendees'], op['location'], op['categories'], op['free'] )
+        else:
+            record = self.new_event(
+                op['start'], op['end'], op['subject'], op['attendees'], op['location'], op['categories'] )
+        return ( record.item_id, record.changekey )
+
+    def write_batch( self, ops ):
+        self._call( 'write_batch' )
+        results = []
+        for op in ops:
+            if op['action'] == 'update':
+                with self.lock:
+                    record = self.events.get( op['event'].item_id )
+                if record is None:
+                    results.append( ( op, FakeError( f'No such event "{op["event"].item_id}"' ) ) )
+                    continue
+                record.attendees = tuple( op['attendees'] )
+                results.append( ( op, self._store( record ) ) )
+            else:
+                record = self.add_event( op['start'], op['subject'], op['attendees'] )
+                results.append( ( op, ( record.item_id, record.changekey ) ) )
+        return results
+
+    def throttle_errors( self ):
+        return ( FakeThrottled, )
+
+
+class IcsBackend( Backend ):
+    ''' Calendar in an iCalendar (.ics) file.
+        The file is read when first needed, changes are kept in memory
+        and the whole calendar is written back in one go by flush().
+        Events that don't match regex_map are kept as they are.
+    '''
+
+    def __init__( self, path, regex_map ):
+        self.path = pathlib.Path( path )
+        self.regexes = libstore.compile_regex_map( regex_map )
+        # uid -> VEVENT content lines, in file order
+        self.events = None
+        # EventRecords of self.events, sorted by start (None: parse again)
+        self.records = None
+        self.changed = False
+        self.lock = threading.Lock()
+
+    def _load( self ):
+        if self.events is None:
+            self.events = {}
+            if self.path.exists():
+                for n, lines in enumerate( libics.read_events( self.path ) ):
+                    uid = libics.uid_of( lines ) or f'no-uid-{n}'
+                    self.events[uid] = lines
+        return self.events
+
+    def _signature( self ):
+        try:
+            return str( os.stat( self.path ).st_mtime_ns )
+        except FileNotFoundError:
+            return 'none'
+
+    def _records( self ):
+        if self.records is None:
+            records = ( libics.mk_record( lines, self.regexes ) for lines in self._load().values() )
+            self.records = sorted( ( e for e in records if e ), key=lambda e: e.start )
+        return self.records
+
+    def fetch( self, start, end ):
+        with self.lock:
+            records = self._records()
+            lo = bisect.bisect_left( records, start, key=lambda e: e.start )
+            hi = bisect.bisect_right( records, end, key=lambda e: e.start )
+            return records[lo:hi]
+
+    def sync( self, sync_state ):
+        ''' The file has no change log: a changed file means a full sync
+        '''
+        with self.lock:
+            signature = self._signature()
+            if sync_state == signature:
+                return ( [], signature )
+            if sync_state is not None:
+                raise libstore.SyncStateExpired( sync_state )
+            # read the file again, it changed
+            self.events = None
+            self.records = None
+            return ( [ ( e.item_id, e ) for e in self._records() ], signature )
+
+    def execute( self, op ):
+        with self.lock:
+            events = self._load()
+            if op['action'] == 'update':
+                uid = op['event'].item_id
+                if uid not in events:
+                    raise KeyError( f'No event "{uid}" in "{self.path}"' )
+                events[uid] = libics.update_event( events[uid], op['attendees'], op.get( 'hash' ) )
+            else:
+                uid = f'{uuid.uuid4()}@asd-triage-scheduler'
+                events[uid] = libics.mk_event( op, uid )
+            self.changed = True
+            self.records = None
+            return ( uid, libics.changekey( events[uid] ) )
+
+    def write_batch( self, ops ):
+        results = []
+        for op in ops:
+            try:
+                results.append( ( op, self.execute( op ) ) )
+            except Exception as e:
+                results.append( ( op, e ) )
+        return results
+
+    def flush( self ):
+        with self.lock:
+            if self.changed:
+                libics.write_events( self.path, self.events.values() )
+                self.changed = False
+
+
+def copy_record( e ):
+    ''' Independent copy, so callers can't change the fake calendar by accident
+    '''
+    return libstore.EventRecord( e.start, e.type, e.subject, e.attendees, e.item_id, e.changekey, e.state_hash )
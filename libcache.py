@@ -0,0 +1,98 @@
+#!/bin/env python3
+
+import json
+import logging
+import os
+import pathlib
+
+import libstore
+
+# Bump when the cache file layout changes, older files are then ignored
+VERSION = 4
+
+
+class EventCache( object ):
+    ''' On disk copy of all TRIAGE and HANDOFF events in the calendar,
+        keyed by exchange item id.
+        sync() downloads only the changes since the previous sync.
+        regex_map = the regexes the event types come from; a cache file
+        saved with other regexes is ignored (the next sync is a full one)
+    '''
+
+    def __init__( self, path, regex_map ):
+        self.path = pathlib.Path( path )
+        self.regex_map = regex_map
+        self.sync_state = None
+        self.events = {}
+
+    def clear( self ):
+        self.sync_state = None
+        self.events = {}
+
+    def load( self ):
+        try:
+            data = json.loads( self.path.read_text() )
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logging.warning( f'Ignoring unreadable cache file "{self.path}": {e}' )
+            return
+        if data.get( 'version' ) != VERSION:
+            logging.info( f'Ignoring cache file "{self.path}" from another version' )
+            return
+        if data.get( 'regex_map' ) != self.regex_map:
+            logging.info( f'Ignoring cache file "{self.path}" made with other event regexes' )
+            return
+        self.sync_state = data['sync_state']
+        self.events = {}
+        for e in data['events']:
+            record = libstore.EventRecord.from_json( e )
+            self.events[ record.item_id ] = record
+        logging.debug( f'Loaded {len(self.events)} events from cache "{self.path}"' )
+
+    def save( self ):
+        data = {
+            'version': VERSION,
+            'regex_map': self.regex_map,
+            'sync_state': self.sync_state,
+            'events': [ e.to_json() for e in self.events.values() ],
+        }
+        self.path.parent.mkdir( parents=True, exist_ok=True )
+        tmp = self.path.with_name( self.path.name + '.tmp' )
+        tmp.write_text( json.dumps( data ) )
+        os.replace( tmp, self.path )
+
+    def sync( self, backend ):
+        ''' Apply all calendar changes since the last sync
+            (everything, if there is no previous sync state)
+            backend = libbackend.Backend
+            Return list of the changed events, both as they were and as they are now
+        '''
+        try:
+            changes, sync_state = backend.sync( self.sync_state )
+        except libstore.SyncStateExpired:
+            logging.warning( 'Calendar sync state expired, doing a full sync' )
+            self.clear()
+            changes, sync_state = backend.sync( None )
+        self.sync_state = sync_state
+        changed = []
+        removed = 0
+        for item_id, record in changes:
+            if record is None:
+                old = self.events.pop( item_id, None )
+                removed += 1
+            else:
+                old = self.events.get( item_id )
+                self.events[ item_id ] = record
+                changed.append( record )
+            if old:
+                changed.append( old )
+        logging.info( f'Calendar sync: {len(changes) - removed} new or changed, {removed} removed events' )
+        return changed
+
+    def events_between( self, start, end ):
+        ''' Cached events on dates from start to end (inclusive)
+            start = datetime.date
+            end = datetime.date
+        '''
+        return [ e for e in self.events.values() if start <= e.date <= end ]
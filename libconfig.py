@@ -0,0 +1,96 @@
+#!/bin/env python3
+
+import pathlib
+import re
+
+# Settings a group may have; missing ones come from the command line / environment
+GROUP_KEYS = (
+    'staff_file',
+    'pto_file',
+    'location_file',
+    'subject_prefix',
+    'regex_map',
+    'categories',
+    'team_size',
+    'start_at',
+)
+
+# Group names become part of event type names ("GROUP/TRIAGE")
+NAME_RE = re.compile( r'^[A-Za-z0-9_.-]+$' )
+
+
+class Group( object ):
+    ''' Settings of one triage rotation from the --config file,
+        and the data memoized for it while running (see run.group_resources())
+    '''
+    __slots__ = ( 'name', 'settings', 'resources' )
+
+    def __init__( self, name, settings ):
+        self.name = name
+        self.settings = settings
+        self.resources = {}
+
+    def __repr__( self ):
+        return f'Group( {self.name} )'
+
+
+def read_config( path ):
+    ''' Read a YAML file like
+            defaults:                  # optional, settings shared by all groups
+              location_file: /home/asd_triage_location
+            groups:
+              asd:
+                staff_file: /home/asd_triage_staff
+              ops:
+                staff_file: /home/ops_triage_staff
+                subject_prefix: Ops Triage
+        Return list of Groups, in file order
+    '''
+    import yaml
+    data = yaml.safe_load( pathlib.Path( path ).read_text() ) or {}
+    defaults = data.get( 'defaults' ) or {}
+    check_settings( path, 'defaults', defaults )
+    groups = []
+    for name, settings in ( data.get( 'groups' ) or {} ).items():
+        name = str( name )
+        if not NAME_RE.match( name ):
+            raise UserWarning( f'{path}: invalid group name "{name}", use letters, digits, "_", "-", "."' )
+        settings = dict( defaults, **( settings or {} ) )
+        check_settings( path, name, settings )
+        if not settings.get( 'staff_file' ):
+            raise UserWarning( f'{path}: group "{name}" has no staff_file' )
+        groups.append( Group( name, settings ) )
+    if not groups:
+        raise UserWarning( f'{path}: no groups defined' )
+    return groups
+
+
+def check_settings( path, name, settings ):
+    unknown = set( settings ) - set( GROUP_KEYS )
+    if unknown:
+        raise UserWarning( f'{path}: unknown settings for "{name}": {", ".join( sorted( unknown ) )}' )
+
+
+def check_overlap( path, events ):
+    ''' Raise UserWarning if the events of one group would be taken for those of another
+        (an event belongs to the first group whose regexes match its subject,
+        the other group would never find its events and create them again)
+        events = dict of group name -> ( regex_map, subjects of events the group creates )
+    '''
+    for name, ( regex_map, subjects ) in events.items():
+        for other, ( other_map, _ ) in events.items():
+            if other == name:
+                continue
+            same = set( regex_map.values() ) & set( other_map.values() )
+            if same:
+                raise UserWarning(
+                    f'{path}: groups "{name}" and "{other}" use the same event regex "{min( same )}",'
+                    f' give them different subject_prefix or regex_map settings'
+                )
+            for subject in subjects:
+                for typ, pattern in other_map.items():
+                    if re.search( pattern, subject ):
+                        raise UserWarning(
+                            f'{path}: "{subject}" of group "{name}" matches the {typ} regex'
+                            f' of group "{other}", give them different subject_prefix or regex_map settings'
+                        )
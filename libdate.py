@@ -1,9 +1,9 @@
 #!/bin/env python3
 
+import csv
 import datetime
 import logging
 import pprint
-import pandas
 import os
 
 
@@ -18,30 +18,132 @@ def daynames():
 
 
 def holidays():
-    ''' list of datetime.date values for holidays
+    ''' numpy array (datetime64[D]) of holidays from TRIAGE_HOLIDAYS_FILE
+        Re-read when the file modification time changes.
     '''
-    key = 'holidays'
-    if key not in resources:
-        filename = os.environ['TRIAGE_HOLIDAYS_FILE']
-        df = pandas.read_csv( filename ).squeeze( 'columns' )
-        dti = pandas.to_datetime( df )
-        # for d in dti:
-        #     logging.debug( pprint.pformat( d ) )
-        resources[key] = dti
-    return resources[key]
+    return get_work_calendar().holidays
+
+
+def read_holidays( filename ):
+    ''' List of datetime.date from a CSV file with one header "date"
+    '''
+    with open( filename, newline='' ) as fh:
+        reader = csv.reader( fh )
+        next( reader, None )
+        return [ parse_date( row[0].strip() ) for row in reader if row and row[0].strip() ]
+
+
+def get_work_calendar():
+    ''' WorkCalendar built from TRIAGE_HOLIDAYS_FILE,
+        rebuilt (dropping all cached results) when the file changes
+    '''
+    key = 'work_calendar'
+    filename = os.environ['TRIAGE_HOLIDAYS_FILE']
+    mtime = os.stat( filename ).st_mtime_ns
+    cal = resources.get( key )
+    if cal is None or cal.source != ( filename, mtime ):
+        logging.debug( f'Loading holidays from "{filename}"' )
+        cal = WorkCalendar( read_holidays( filename ) )
+        cal.source = ( filename, mtime )
+        resources[key] = cal
+    return cal
+
+
+class WorkCalendar( object ):
+    ''' Work days (Mon-Fri, excluding holidays) backed by a numpy business day calendar.
+        Query methods accept a single date or an array of dates.
+    '''
+
+    def __init__( self, holidays, weekmask='1111100' ):
+        import numpy
+        self.holidays = numpy.array( sorted( holidays ), dtype='datetime64[D]' )
+        self.busdaycal = numpy.busdaycalendar( weekmask=weekmask, holidays=self.holidays )
+        self.source = None
+        self.cache = {}
+
+    def to_day( self, value ):
+        ''' datetime64[D] (or array of) from date, datetime, string or array-like
+        '''
+        import numpy
+        if isinstance( value, str ):
+            value = parse_date( value )
+        elif isinstance( value, datetime.datetime ):
+            value = value.date()
+        return numpy.asarray( value, dtype='datetime64[D]' )
+
+    def workdays( self, start, end ):
+        ''' datetime64[D] array of work days from start to end (inclusive)
+            Cached per ( start, end ).
+        '''
+        import numpy
+        start = self.to_day( start )
+        end = self.to_day( end )
+        key = ( int( start.astype( int ) ), int( end.astype( int ) ) )
+        if key not in self.cache:
+            days = numpy.arange( start, end + 1, dtype='datetime64[D]' )
+            days = days[ numpy.is_busday( days, busdaycal=self.busdaycal ) ]
+            days.flags.writeable = False
+            self.cache[key] = days
+        return self.cache[key]
+
+    def is_workday( self, dates ):
+        import numpy
+        return numpy.is_busday( self.to_day( dates ), busdaycal=self.busdaycal )
+
+    def nth_workday( self, dates, n ):
+        ''' The n-th work day after dates (n=0 is dates itself, or the next work day)
+        '''
+        import numpy
+        return numpy.busday_offset( self.to_day( dates ), n, roll='forward', busdaycal=self.busdaycal )
+
+    def count( self, start, end ):
+        ''' Number of work days from start to end (inclusive)
+        '''
+        import numpy
+        end = self.to_day( end ) + 1
+        return numpy.busday_count( self.to_day( start ), end, busdaycal=self.busdaycal )
+
+
+def parse_date( text ):
+    ''' datetime.date from a YYYY-MM-DD string,
+        other formats are handed to pandas
+    '''
+    try:
+        return datetime.date.fromisoformat( text )
+    except ValueError:
+        import pandas
+        return pandas.to_datetime( text ).date()
 
 
 def get_workdays( start, end ):
     ''' list of dates from start to end excluding weekends and holidays
         start: string or datetime object
         end: string or datetime object
+        Return list of datetime.date
+    '''
+    return get_work_calendar().workdays( start, end ).tolist()
+
+
+def split_range( start, end, freq ):
+    ''' Split the dates from start to end into consecutive windows
+        start: string or datetime object
+        end: string or datetime object
+        freq: pandas frequency string for the window boundaries, such as 'MS' (month start)
+        Return list of ( window_start, window_end ) datetime.date tuples (inclusive)
     '''
-    return pandas.bdate_range(
-        start = start,
-        end = end,
-        freq = 'C',
-        holidays = list( holidays() ),
-        )
+    import pandas
+    start = pandas.Timestamp( start ).normalize()
+    end = pandas.Timestamp( end ).normalize()
+    bounds = [ start ]
+    bounds.extend( b for b in pandas.date_range( start, end, freq=freq ) if b > start )
+    windows = []
+    for i, b in enumerate( bounds ):
+        if i + 1 < len( bounds ):
+            w_end = bounds[i + 1] - datetime.timedelta( days=1 )
+        else:
+            w_end = end
+        windows.append( ( b.date(), w_end.date() ) )
+    return windows
 
 
 if __name__ == '__main__':
@@ -0,0 +1,234 @@
+#!/bin/env python3
+
+import datetime
+import logging
+
+import exchangelib
+import exchangelib.errors
+from exchangelib.items import SEND_TO_ALL_AND_SAVE_COPY, SEND_TO_CHANGED_AND_SAVE_COPY
+
+import libplan
+import libstore
+
+
+class TriageHash( exchangelib.ExtendedProperty ):
+    ''' Hash of the desired state of an event, see libplan.state_hash()
+    '''
+    distinguished_property_set_id = 'PublicStrings'
+    property_name = 'asd-triage-hash'
+    property_type = 'String'
+
+
+exchangelib.CalendarItem.register( 'triage_hash', TriageHash )
+
+# The only event fields the scheduler reads (id and changekey are always included)
+FIELDS = ( 'subject', 'start', 'required_attendees', 'triage_hash' )
+
+# The only event fields an "update" op changes
+UPDATE_FIELDS = [ 'required_attendees', 'triage_hash' ]
+
+
+def get_account( px ):
+    ''' The exchangelib Account behind a pyexch.PyExch instance
+    '''
+    return px.account
+
+
+def local_datetime( value, tz ):
+    ''' Naive local datetime from an exchange start value
+        (EWSDate for all day events, aware EWSDateTime otherwise)
+    '''
+    if isinstance( value, datetime.datetime ):
+        if value.tzinfo:
+            value = value.astimezone( tz )
+        return value.replace( tzinfo=None )
+    return datetime.datetime.combine( value, datetime.time() )
+
+
+def mk_record( item, typ, tz ):
+    ''' libstore.EventRecord from an exchangelib CalendarItem
+    '''
+    return libstore.EventRecord(
+        start = local_datetime( item.start, tz ),
+        typ = typ,
+        subject = item.subject,
+        attendees = [ a.mailbox.email_address for a in item.required_attendees or [] ],
+        item_id = item.id,
+        changekey = item.changekey,
+        state_hash = item.triage_hash,
+    )
+
+
+def fetch_records( px, start, end, regexes ):
+    ''' Get TRIAGE and HANDOFF events between start and end (naive local datetimes),
+        requesting only the fields in FIELDS.
+        Return list of libstore.EventRecords
+    '''
+    account = get_account( px )
+    tz = account.default_timezone
+    items = account.calendar.view(
+        start = exchangelib.EWSDateTime.from_datetime( start.replace( tzinfo=tz ) ),
+        end = exchangelib.EWSDateTime.from_datetime( end.replace( tzinfo=tz ) ),
+    ).only( *FIELDS )
+    records = []
+    for item in items:
+        typ = libstore.classify( regexes, item.subject )
+        if typ:
+            records.append( mk_record( item, typ, tz ) )
+    return records
+
+
+def sync_records( px, sync_state, regexes ):
+    ''' All TRIAGE and HANDOFF changes in the calendar since sync_state
+        (everything, if sync_state is None)
+        Return ( changes, new_sync_state ), see libbackend.Backend.sync()
+    '''
+    account = get_account( px )
+    folder = account.calendar
+    # item_id -> ItemId for created / updated events of interest, None for removals
+    changes = {}
+    try:
+        for change_type, item in folder.sync_items( sync_state=sync_state, only_fields=[ 'subject' ] ):
+            if change_type in ( 'create', 'update' ) and libstore.classify( regexes, item.subject ):
+                changes[ item.id ] = item
+            elif change_type in ( 'create', 'update', 'delete' ):
+                changes[ item.id ] = None
+    except exchangelib.errors.ErrorInvalidSyncStateData:
+        raise libstore.SyncStateExpired( sync_state )
+    wanted = [ item for item in changes.values() if item is not None ]
+    records = {}
+    if wanted:
+        for item in account.fetch( ids=wanted, only_fields=FIELDS ):
+            if isinstance( item, Exception ):
+                logging.debug( f'Skipping event that disappeared during sync: {item}' )
+                continue
+            typ = libstore.classify( regexes, item.subject )
+            records[ item.id ] = mk_record( item, typ, account.default_timezone )
+    rv = [ ( item_id, records.get( item_id ) ) for item_id in changes ]
+    return ( rv, folder.item_sync_state )
+
+
+def mk_update_item( account, record, attendees, state_hash=None ):
+    ''' exchangelib CalendarItem to send a new attendee list for an existing event
+        record = libstore.EventRecord
+    '''
+    return exchangelib.CalendarItem(
+        account = account,
+        folder = account.calendar,
+        id = record.item_id,
+        changekey = record.changekey,
+        required_attendees = attendees,
+        triage_hash = state_hash,
+    )
+
+
+def update_item( px, op ):
+    ''' Send the attendee list (and state hash) of an "update" op,
+        leaving the other fields of the event alone
+        Return ( item_id, changekey )
+    '''
+    item = mk_update_item( get_account( px ), op['event'], op['attendees'], op.get( 'hash' ) )
+    item.save(
+        update_fields = UPDATE_FIELDS,
+        send_meeting_invitations = SEND_TO_CHANGED_AND_SAVE_COPY,
+    )
+    return ( item.id, item.changekey )
+
+
+def mk_calendar_item( account, op ):
+    ''' Build an (unsaved) exchangelib CalendarItem from a "create" op
+        op = dict, see libplan.mk_create_op()
+    '''
+    tz = account.default_timezone
+    if op['all_day']:
+        start = exchangelib.EWSDate.from_date( libplan.to_date( op['start'] ) )
+        end = start + datetime.timedelta( days=1 )
+    else:
+        start = exchangelib.EWSDateTime.from_datetime( op['start'].replace( tzinfo=tz ) )
+        end = exchangelib.EWSDateTime.from_datetime( op['end'].replace( tzinfo=tz ) )
+    return exchangelib.CalendarItem(
+        account = account,
+        folder = account.calendar,
+        subject = op['subject'],
+        start = start,
+        end = end,
+        is_all_day = op['all_day'],
+        required_attendees = op['attendees'],
+        location = op['location'],
+        categories = op['categories'],
+        legacy_free_busy_status = 'Free' if op['free'] else 'Busy',
+        triage_hash = op.get( 'hash' ),
+    )
+
+
+def create_item( px, op ):
+    ''' Create the event of a "create" op (with its state hash)
+        Return ( item_id, changekey )
+    '''
+    item = mk_calendar_item( get_account( px ), op )
+    item.save( send_meeting_invitations = SEND_TO_ALL_AND_SAVE_COPY )
+    return ( item.id, item.changekey )
+
+
+def set_max_connections( px, count ):
+    ''' Allow up to count simultaneous HTTP sessions to exchange
+        (exchangelib defaults to a single session per account)
+    '''
+    protocol = get_account( px ).protocol
+    if protocol.max_connections < count:
+        protocol.max_connections = count
+
+
+def bulk_create( px, ops ):
+    ''' Create new calendar events in a single request
+        Return list of ( op, result ) where result is either
+        an ( item_id, changekey ) tuple or an exception instance
+    '''
+    account = get_account( px )
+    items = [ mk_calendar_item( account, op ) for op in ops ]
+    rv = account.bulk_create(
+        folder = account.calendar,
+        items = items,
+        send_meeting_invitations = SEND_TO_ALL_AND_SAVE_COPY,
+    )
+    results = []
+    for op, r in zip( ops, rv ):
+        if not isinstance( r, Exception ):
+            r = ( r.id, r.changekey )
+        results.append( ( op, r ) )
+    return results
+
+
+def bulk_update( px, ops ):
+    ''' Update attendees of existing calendar events in a single request
+        Return list of ( op, result ) where result is either
+        an ( item_id, changekey ) tuple or an exception instance
+    '''
+    account = get_account( px )
+    items = []
+    for op in ops:
+        item = mk_update_item( account, op['event'], op['attendees'], op.get( 'hash' ) )
+        items.append( ( item, UPDATE_FIELDS ) )
+    rv = account.bulk_update(
+        items = items,
+        send_meeting_invitations_or_cancellations = SEND_TO_CHANGED_AND_SAVE_COPY,
+    )
+    return list( zip( ops, rv ) )
+
+
+def bulk_write( px, ops ):
+    ''' Send a batch of "create" and "update" ops to exchange
+        (at most one request for each kind).
+        Raises if a whole request fails.
+        Return list of ( op, result ), see bulk_create() and bulk_update()
+    '''
+    creates = [ op for op in ops if op['action'] == 'create' ]
+    updates = [ op for op in ops if op['action'] == 'update' ]
+    results = []
+    if creates:
+        logging.debug( f'Bulk create {len(creates)} events' )
+        results.extend( bulk_create( px, creates ) )
+    if updates:
+        logging.debug( f'Bulk update {len(updates)} events' )
+        results.extend( bulk_update( px, updates ) )
+    return results
@@ -1,31 +1,134 @@
 #!/bin/env python3
 
-import itertools
+import math
 import pprint
-import logging
+
+
+class FairTeams( object ):
+    ''' Rotation of teams of size k, built lazily.
+        Members are split into k groups (earlier groups are shorter if the count
+        does not divide evenly) and each team takes one member from every group,
+        such that individual recurrences are as far apart as possible.
+        Team i is computed on demand, so random access is O(1)
+        and nothing proportional to the rotation length is allocated.
+        For k=2 the rotation is the same as fair_pairs().
+        offset = rotate the start of the rotation by this many teams
+    '''
+
+    def __init__( self, members, k=2, offset=0 ):
+        members = list( members )
+        if k < 1 or k > len( members ):
+            raise UserWarning( f'Cannot make teams of {k} from {len(members)} members' )
+        base, extra = divmod( len( members ), k )
+        sizes = [ base + int( g >= k - extra ) for g in range( k ) ]
+        self.groups = []
+        pos = 0
+        for size in sizes:
+            self.groups.append( members[pos:pos + size] )
+            pos += size
+        self.members = members
+        self.k = k
+        # Group g advances one member per team, plus one extra every blocks[g] teams.
+        # The j-th group counting back from the last group of the same size
+        # uses blocks of size**j teams (j=0: no extra step),
+        # so groups of the same size don't always line up the same way.
+        self.blocks = []
+        for g, n in enumerate( sizes ):
+            j = sum( 1 for m in sizes[g + 1:] if m == n )
+            self.blocks.append( n ** j if j else 0 )
+        # each group repeats after size**(j+1) teams
+        periods = [ n * b if b else n for n, b in zip( sizes, self.blocks ) ]
+        self.length = math.lcm( *periods )
+        self.offset = offset % self.length
+        self._index = None
+        self._by_member = None
+
+    def __len__( self ):
+        return self.length
+
+    def __getitem__( self, i ):
+        ''' Team i of the rotation, indexes wrap around
+        '''
+        c = ( i + self.offset ) % self.length
+        team = []
+        for group, block in zip( self.groups, self.blocks ):
+            extra = c // block if block else 0
+            team.append( group[ ( c + extra ) % len( group ) ] )
+        return tuple( team )
+
+    def __iter__( self ):
+        ''' One full rotation
+        '''
+        for i in range( self.length ):
+            yield self[i]
+
+    def team_index( self ):
+        ''' dict of frozenset( team ) -> index in the rotation
+            (the first one, if a team comes up more than once), built on first use
+        '''
+        if self._index is None:
+            index = {}
+            by_member = {}
+            for i, team in enumerate( self ):
+                index.setdefault( frozenset( team ), i )
+                for m in team:
+                    by_member.setdefault( m, [] ).append( i )
+            self._index = index
+            self._by_member = by_member
+        return self._index
+
+    def nearest_index( self, team, near=None ):
+        ''' Index of team in the rotation.
+            A team that is not in the rotation (such as a manual swap) gets the index
+            of the team sharing the most members with it; ties go to the index
+            closest to "near" (if given), else to the lowest index.
+            Return None if no team in the rotation shares a member
+        '''
+        key = frozenset( team )
+        index = self.team_index()
+        if key in index:
+            return index[key]
+        candidates = set()
+        for m in key:
+            candidates.update( self._by_member.get( m, () ) )
+        if not candidates:
+            return None
+        def distance( i ):
+            if near is None:
+                return i
+            d = ( i - near ) % self.length
+            return min( d, self.length - d )
+        return min( candidates, key=lambda i: ( -len( key.intersection( self[i] ) ), distance( i ) ) )
+
+    def index_arrays( self ):
+        ''' For each group, numpy array of the group index used by every team of the rotation
+        '''
+        import numpy
+        c = numpy.arange( self.length )
+        return [ ( c + ( c // block if block else 0 ) ) % len( group )
+                 for group, block in zip( self.groups, self.blocks ) ]
+
+    def recurrence_stats( self ):
+        ''' Distance (in teams) between consecutive duties of each member,
+            over one rotation, wrapping around at the end.
+            Return dict of member -> ( min_distance, mean_distance )
+        '''
+        import numpy
+        stats = {}
+        for group, idx in zip( self.groups, self.index_arrays() ):
+            for m, name in enumerate( group ):
+                positions = numpy.flatnonzero( idx == m )
+                gaps = numpy.diff( positions, append=positions[0] + self.length )
+                stats[name] = ( int( gaps.min() ), float( gaps.mean() ) )
+        return stats
+
 
 def fair_pairs( members ):
     ''' Split members list in half, create all pairings such that
         individual recurrences are as far apart as possible
     '''
-    # first half and second half, if count is odd, first half is shorter
-    L1 = members[:len(members)//2]
-    L2 = members[len(members)//2:]
-    L1_size = len(L1)
-    L2_size = len(L2)
-    scalar = int( L1_size == L2_size )
-
-    fairlist = []
-    loopcount = -1
-    for counter in range( L1_size * L2_size ):
-        if counter % L1_size == 0:
-            loopcount = loopcount + 1
-            logging.debug( f'loopcount={loopcount}' )
-        i = ( counter + (loopcount * scalar) ) % L1_size
-        j = counter % L2_size
-        logging.debug( f'{counter:02d}  ({i}, {j}) .. {L1[i] , L2[j]}' )
-        fairlist.append( ( L1[i], L2[j] ) )
-    return fairlist
+    return list( FairTeams( members, k=2 ) )
+
 
 if __name__ == '__main__':
 
@@ -43,3 +146,4 @@ if __name__ == '__main__':
     duty_pairs = fair_pairs( staff )
     for i, elem in enumerate( duty_pairs ):
         print( f'{i:02d} {elem}' )
+    print( pprint.pformat( FairTeams( staff, k=3 ).recurrence_stats() ) )
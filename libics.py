@@ -0,0 +1,229 @@
+#!/bin/env python3
+
+import datetime
+import hashlib
+import os
+import pathlib
+
+import libstore
+
+# Property holding the desired state hash (see libplan.state_hash())
+HASH_PROP = 'X-ASD-TRIAGE-HASH'
+
+PRODID = '-//NCSA//asd-triage-scheduler//EN'
+
+
+def escape( text ):
+    return ( text.replace( '\\', '\\\\' ).replace( ';', '\\;' ).replace( ',', '\\,' )
+             .replace( '\r\n', '\\n' ).replace( '\n', '\\n' ) )
+
+
+def unescape( text ):
+    out = []
+    chars = iter( text )
+    for c in chars:
+        if c == '\\':
+            c = next( chars, '' )
+            c = '\n' if c in 'nN' else c
+        out.append( c )
+    return ''.join( out )
+
+
+def fold( line ):
+    ''' Split a content line into lines of at most 75 octets (RFC 5545 3.1)
+    '''
+    data = line.encode()
+    if len( data ) <= 75:
+        return line + '\r\n'
+    parts = []
+    limit = 75
+    while data:
+        cut = min( limit, len( data ) )
+        # don't split a multi-byte character
+        while cut < len( data ) and ( data[cut] & 0xC0 ) == 0x80:
+            cut -= 1
+        parts.append( data[:cut].decode() )
+        data = data[cut:]
+        limit = 74
+    return '\r\n '.join( parts ) + '\r\n'
+
+
+def unfold( fh ):
+    ''' Yield content lines from an iCalendar file, joining folded lines
+    '''
+    current = None
+    for line in fh:
+        line = line.rstrip( '\r\n' )
+        if line[:1] in ( ' ', '\t' ):
+            if current is not None:
+                current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current:
+        yield current
+
+
+def parse_line( line ):
+    ''' Return ( NAME, params dict, value ) of a content line
+    '''
+    head, _, value = line.partition( ':' )
+    # a ":" inside a quoted parameter value belongs to the head
+    while head.count( '"' ) % 2:
+        more, _, value = value.partition( ':' )
+        head = f'{head}:{more}'
+    name, *params = head.split( ';' )
+    return ( name.upper(), dict( p.partition( '=' )[::2] for p in params ), value )
+
+
+def read_events( path ):
+    ''' Return list of VEVENTs in the file, each a list of content lines
+    '''
+    events = []
+    current = None
+    with open( path, newline='' ) as fh:
+        for line in unfold( fh ):
+            upper = line.upper()
+            if upper == 'BEGIN:VEVENT':
+                current = []
+            elif upper == 'END:VEVENT':
+                if current is not None:
+                    events.append( current )
+                current = None
+            elif current is not None:
+                current.append( line )
+    return events
+
+
+def write_events( path, events ):
+    ''' Write all events (lists of content lines) as one calendar, in a single pass
+        (to a temporary file, which then replaces path)
+    '''
+    path = pathlib.Path( path )
+    path.parent.mkdir( parents=True, exist_ok=True )
+    tmp = path.with_name( path.name + '.tmp' )
+    with open( tmp, 'w', newline='' ) as fh:
+        fh.write( f'BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:{PRODID}\r\nCALSCALE:GREGORIAN\r\n' )
+        for lines in events:
+            fh.write( 'BEGIN:VEVENT\r\n' )
+            fh.writelines( fold( line ) for line in lines )
+            fh.write( 'END:VEVENT\r\n' )
+        fh.write( 'END:VCALENDAR\r\n' )
+    os.replace( tmp, path )
+
+
+def format_datetime( value ):
+    return value.strftime( '%Y%m%dT%H%M%S' )
+
+
+def parse_datetime( value, params ):
+    ''' Naive local datetime from a DATE or DATE-TIME value
+        (UTC times are converted to local time, TZID is ignored)
+    '''
+    if params.get( 'VALUE', '' ).upper() == 'DATE' or len( value ) == 8:
+        return datetime.datetime.strptime( value, '%Y%m%d' )
+    if value.endswith( 'Z' ):
+        utc = datetime.datetime.strptime( value, '%Y%m%dT%H%M%SZ' ).replace( tzinfo=datetime.timezone.utc )
+        return utc.astimezone().replace( tzinfo=None )
+    return datetime.datetime.strptime( value, '%Y%m%dT%H%M%S' )
+
+
+def attendee_lines( attendees ):
+    return [ f'ATTENDEE;ROLE=REQ-PARTICIPANT:mailto:{a}' for a in attendees ]
+
+
+def mk_event( op, uid ):
+    ''' Content lines of a new VEVENT from a "create" op (see libplan.mk_create_op())
+    '''
+    if op['all_day']:
+        day = op['start'].date()
+        times = [
+            f'DTSTART;VALUE=DATE:{day:%Y%m%d}',
+            f'DTEND;VALUE=DATE:{day + datetime.timedelta( days=1 ):%Y%m%d}',
+        ]
+    else:
+        times = [ f'DTSTART:{format_datetime( op["start"] )}' ]
+        if op['end']:
+            times.append( f'DTEND:{format_datetime( op["end"] )}' )
+    lines = [
+        f'UID:{uid}',
+        f'DTSTAMP:{datetime.datetime.now( datetime.timezone.utc ):%Y%m%dT%H%M%SZ}',
+        'SEQUENCE:0',
+        f'SUMMARY:{escape( op["subject"] )}',
+    ]
+    lines.extend( times )
+    if op['location']:
+        lines.append( f'LOCATION:{escape( op["location"].strip() )}' )
+    if op['categories']:
+        lines.append( f'CATEGORIES:{",".join( escape( c ) for c in op["categories"] )}' )
+    lines.append( f'TRANSP:{"TRANSPARENT" if op["free"] else "OPAQUE"}' )
+    lines.extend( attendee_lines( op['attendees'] ) )
+    if op.get( 'hash' ):
+        lines.append( f'{HASH_PROP}:{op["hash"]}' )
+    return lines
+
+
+def changekey( lines ):
+    ''' Digest of the event content, changes with any edit to it
+        (SEQUENCE is often left alone by hand edits)
+    '''
+    return hashlib.sha1( '\n'.join( lines ).encode() ).hexdigest()[:16]
+
+
+def update_event( lines, attendees, state_hash ):
+    ''' Content lines of a VEVENT with new attendees and hash, and the next SEQUENCE
+    '''
+    sequence = 0
+    kept = []
+    for line in lines:
+        name, params, value = parse_line( line )
+        if name == 'SEQUENCE':
+            sequence = int( value or 0 )
+        elif name not in ( 'ATTENDEE', HASH_PROP ):
+            kept.append( line )
+    sequence += 1
+    kept.append( f'SEQUENCE:{sequence}' )
+    kept.extend( attendee_lines( attendees ) )
+    if state_hash:
+        kept.append( f'{HASH_PROP}:{state_hash}' )
+    return kept
+
+
+def uid_of( lines ):
+    for line in lines:
+        name, params, value = parse_line( line )
+        if name == 'UID':
+            return value
+    return None
+
+
+def mk_record( lines, regexes ):
+    ''' libstore.EventRecord for a VEVENT, None if it is not one of ours
+        regexes = output of libstore.compile_regex_map()
+    '''
+    props = {}
+    attendees = []
+    for line in lines:
+        name, params, value = parse_line( line )
+        if name == 'ATTENDEE':
+            if params.get( 'ROLE', 'REQ-PARTICIPANT' ).upper() == 'REQ-PARTICIPANT':
+                attendees.append( value[7:] if value.lower().startswith( 'mailto:' ) else value )
+        elif name not in props:
+            props[name] = ( params, value )
+    if 'SUMMARY' not in props or 'DTSTART' not in props:
+        return None
+    subject = unescape( props['SUMMARY'][1] )
+    typ = libstore.classify( regexes, subject )
+    if not typ:
+        return None
+    params, value = props['DTSTART']
+    return libstore.EventRecord(
+        start = parse_datetime( value, params ),
+        typ = typ,
+        subject = subject,
+        attendees = attendees,
+        item_id = props.get( 'UID', ( None, None ) )[1],
+        changekey = changekey( lines ),
+        state_hash = props.get( HASH_PROP, ( None, None ) )[1],
+    )
@@ -0,0 +1,117 @@
+#!/bin/env python3
+
+import datetime
+import json
+import logging
+import os
+import pathlib
+import threading
+
+import libplan
+
+# Bump when the journal line layout changes
+VERSION = 1
+
+
+def op_key( op ):
+    ''' Journal key of an op: date and event type (with the --config group, if any)
+    '''
+    typ = f'{op["group"]}/{op["type"]}' if op.get( 'group' ) else op['type']
+    return f'{op["date"]} {typ}'
+
+
+class Journal( object ):
+    ''' Write-ahead log of calendar changes, one JSON object per line:
+            { "journal": VERSION, "started": ..., "resume": bool }  at the start of each run
+            { "key": KEY, "state": "planned", "op": op }          before the op is sent
+            { "key": KEY, "state": "done", "item_id", "changekey" } after it succeeded
+            { "key": KEY, "state": "failed", "error": message }   after it failed
+        KEY = op_key( op ). An op is pending until a "done" line follows its "planned" line.
+    '''
+
+    def __init__( self, path ):
+        self.path = pathlib.Path( path )
+        self.fh = None
+        # keys planned but not done yet
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def read( self ):
+        ''' Return list of pending ops, in the order they were planned
+        '''
+        pending = {}
+        try:
+            fh = open( self.path )
+        except FileNotFoundError:
+            return []
+        with fh:
+            for n, line in enumerate( fh, start=1 ):
+                try:
+                    data = json.loads( line )
+                except ValueError:
+                    # the last line may be cut short by a crash
+                    logging.warning( f'Ignoring unreadable line {n} of journal "{self.path}"' )
+                    continue
+                if 'journal' in data:
+                    if data['journal'] != VERSION:
+                        raise UserWarning( f'Unsupported journal version in "{self.path}"' )
+                elif data['state'] == 'planned':
+                    pending[ data['key'] ] = libplan.op_from_json( data['op'] )
+                elif data['state'] == 'done':
+                    pending.pop( data['key'], None )
+        return list( pending.values() )
+
+    def open( self, resume=False ):
+        ''' Start a new journal, or continue the existing one if resume is True
+        '''
+        left = self.read()
+        if resume:
+            self.pending = { op_key( op ) for op in left }
+        elif left:
+            logging.warning(
+                f'Discarding {len(left)} unfinished changes of an earlier run'
+                f' from journal "{self.path}" (use --resume to finish them)'
+            )
+        self.path.parent.mkdir( parents=True, exist_ok=True )
+        self.fh = open( self.path, 'a' if resume else 'w' )
+        self._write( {
+            'journal': VERSION,
+            'started': datetime.datetime.now().isoformat( timespec='seconds' ),
+            'resume': resume,
+        }, sync=True )
+
+    def _write( self, *entries, sync=False ):
+        with self.lock:
+            for e in entries:
+                if e.get( 'state' ) == 'planned':
+                    self.pending.add( e['key'] )
+                elif e.get( 'state' ) == 'done':
+                    self.pending.discard( e['key'] )
+            self.fh.writelines( json.dumps( e ) + '\n' for e in entries )
+            self.fh.flush()
+            if sync:
+                os.fsync( self.fh.fileno() )
+
+    def planned( self, ops ):
+        ''' Record ops before they are sent to the calendar
+            (ops already recorded and still pending are skipped)
+        '''
+        with self.lock:
+            ops = [ op for op in ops if op_key( op ) not in self.pending ]
+        entries = [ { 'key': op_key( op ), 'state': 'planned', 'op': libplan.op_to_json( op ) } for op in ops ]
+        if entries:
+            self._write( *entries, sync=True )
+
+    def done( self, op, result ):
+        ''' result = ( item_id, changekey ) returned by the calendar, if known
+        '''
+        item_id, changekey = result if isinstance( result, tuple ) else ( None, None )
+        self._write( { 'key': op_key( op ), 'state': 'done', 'item_id': item_id, 'changekey': changekey } )
+
+    def failed( self, op, error ):
+        self._write( { 'key': op_key( op ), 'state': 'failed', 'error': str( error ) } )
+
+    def close( self ):
+        if self.fh:
+            self.fh.close()
+            self.fh = None
@@ -0,0 +1,232 @@
+#!/bin/env python3
+
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import threading
+import time
+
+import libbackend
+import libplan
+
+# Bump when the JSON summary layout changes
+VERSION = 1
+
+# Prefix of all prometheus metric names
+PROM_PREFIX = 'triage_scheduler'
+
+
+class CallStats( object ):
+    ''' Everything recorded for one named call or stage
+        kind = 'call' for calendar requests, 'stage' for local work
+    '''
+    __slots__ = ( 'kind', 'count', 'errors', 'retries', 'bytes', 'items', 'latencies' )
+
+    def __init__( self, kind ):
+        self.kind = kind
+        self.count = 0
+        self.errors = 0
+        self.retries = 0
+        self.bytes = 0
+        self.items = 0
+        self.latencies = []
+
+    def quantile( self, q ):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted( self.latencies )
+        return ordered[ min( len( ordered ) - 1, int( q * len( ordered ) ) ) ]
+
+    def summary( self ):
+        total = sum( self.latencies )
+        return {
+            'kind': self.kind,
+            'count': self.count,
+            'errors': self.errors,
+            'retries': self.retries,
+            'bytes': self.bytes,
+            'items': self.items,
+            'seconds_total': round( total, 6 ),
+            'seconds_mean': round( total / self.count, 6 ) if self.count else 0.0,
+            'seconds_p50': round( self.quantile( 0.5 ), 6 ),
+            'seconds_p95': round( self.quantile( 0.95 ), 6 ),
+            'seconds_max': round( max( self.latencies, default=0.0 ), 6 ),
+        }
+
+
+class Metrics( object ):
+    ''' Counts, latencies, retries and payload sizes for calendar calls
+        and local stages, collected from any thread.
+    '''
+
+    def __init__( self ):
+        self.started = time.time()
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def _get( self, name, kind ):
+        if name not in self.stats:
+            self.stats[name] = CallStats( kind )
+        return self.stats[name]
+
+    def record( self, name, seconds, kind='call', error=False, nbytes=0, items=0 ):
+        with self.lock:
+            s = self._get( name, kind )
+            s.count += 1
+            s.latencies.append( seconds )
+            s.errors += int( error )
+            s.bytes += nbytes
+            s.items += items
+
+    def retry( self, name ):
+        with self.lock:
+            self._get( name, 'call' ).retries += 1
+
+    @contextlib.contextmanager
+    def stage( self, name ):
+        ''' Time the local work in a with block
+        '''
+        t0 = time.perf_counter()
+        error = True
+        try:
+            yield
+            error = False
+        finally:
+            self.record( name, time.perf_counter() - t0, kind='stage', error=error )
+
+    def summary( self, **meta ):
+        ''' JSON-able dict of everything recorded so far
+            meta = extra information to include, such as the command line
+        '''
+        with self.lock:
+            stats = { name: s.summary() for name, s in sorted( self.stats.items() ) }
+        data = {
+            'version': VERSION,
+            'started': datetime.datetime.fromtimestamp( self.started ).isoformat( timespec='seconds' ),
+            'wall_seconds': round( time.time() - self.started, 6 ),
+            'calls': stats,
+        }
+        data.update( meta )
+        return data
+
+    def write_json( self, path, **meta ):
+        write_atomic( path, json.dumps( self.summary( **meta ), indent=1 ) )
+
+    def write_prometheus( self, path ):
+        ''' Write a node_exporter textfile collector file
+        '''
+        data = self.summary()
+        p = PROM_PREFIX
+        lines = [
+            f'# HELP {p}_seconds Latency of calendar calls and local stages.',
+            f'# TYPE {p}_seconds summary',
+        ]
+        for name, s in data['calls'].items():
+            labels = f'name="{name}",kind="{s["kind"]}"'
+            for q, key in ( ( '0.5', 'seconds_p50' ), ( '0.95', 'seconds_p95' ) ):
+                lines.append( f'{p}_seconds{{{labels},quantile="{q}"}} {s[key]}' )
+            lines.append( f'{p}_seconds_sum{{{labels}}} {s["seconds_total"]}' )
+            lines.append( f'{p}_seconds_count{{{labels}}} {s["count"]}' )
+        for field, help_text in (
+                ( 'errors', 'Failed calendar calls and local stages.' ),
+                ( 'retries', 'Calendar calls retried after throttling.' ),
+                ( 'bytes', 'Approximate payload size of calendar calls.' ),
+                ( 'items', 'Events or ops sent or received by calendar calls.' ),
+            ):
+            lines.append( f'# HELP {p}_{field}_total {help_text}' )
+            lines.append( f'# TYPE {p}_{field}_total counter' )
+            for name, s in data['calls'].items():
+                lines.append( f'{p}_{field}_total{{name="{name}",kind="{s["kind"]}"}} {s[field]}' )
+        lines.extend( [
+            f'# HELP {p}_run_seconds Wall time of the last run.',
+            f'# TYPE {p}_run_seconds gauge',
+            f'{p}_run_seconds {data["wall_seconds"]}',
+            f'# HELP {p}_last_run_timestamp_seconds Unix time the last run finished.',
+            f'# TYPE {p}_last_run_timestamp_seconds gauge',
+            f'{p}_last_run_timestamp_seconds {time.time():.0f}',
+        ] )
+        write_atomic( path, '\n'.join( lines ) + '\n' )
+
+
+def write_atomic( path, text ):
+    ''' Readers (such as node_exporter) never see a partly written file
+    '''
+    path = pathlib.Path( path )
+    tmp = path.with_name( path.name + '.tmp' )
+    tmp.write_text( text )
+    os.replace( tmp, path )
+
+
+def payload_size( data ):
+    ''' Approximate size in bytes of events or ops as JSON
+        (the exchange client does not report bytes per call)
+    '''
+    return len( json.dumps( data, default=str ) )
+
+
+class InstrumentedBackend( libbackend.Backend ):
+    ''' Wraps another libbackend.Backend, recording every call in a Metrics
+        under the names "backend.fetch", "backend.sync", "backend.create",
+        "backend.update", "backend.write_batch" and "backend.flush".
+    '''
+
+    def __init__( self, backend, metrics ):
+        self.backend = backend
+        self.metrics = metrics
+
+    def _timed( self, name, func, *args ):
+        ''' Return ( result, seconds ), the failure is recorded before it is raised
+        '''
+        t0 = time.perf_counter()
+        try:
+            rv = func( *args )
+        except Exception:
+            self.metrics.record( name, time.perf_counter() - t0, error=True )
+            raise
+        return ( rv, time.perf_counter() - t0 )
+
+    def fetch( self, start, end ):
+        events, seconds = self._timed( 'backend.fetch', self.backend.fetch, start, end )
+        self.metrics.record( 'backend.fetch', seconds,
+            nbytes = payload_size( [ e.to_json() for e in events ] ),
+            items = len( events ),
+        )
+        return events
+
+    def sync( self, sync_state ):
+        rv, seconds = self._timed( 'backend.sync', self.backend.sync, sync_state )
+        changes = rv[0]
+        self.metrics.record( 'backend.sync', seconds,
+            nbytes = payload_size( [ ( i, e.to_json() if e else None ) for i, e in changes ] ),
+            items = len( changes ),
+        )
+        return rv
+
+    def execute( self, op ):
+        name = f'backend.{op["action"]}'
+        rv, seconds = self._timed( name, self.backend.execute, op )
+        self.metrics.record( name, seconds, nbytes=payload_size( libplan.op_to_json( op ) ), items=1 )
+        return rv
+
+    def write_batch( self, ops ):
+        rv, seconds = self._timed( 'backend.write_batch', self.backend.write_batch, ops )
+        failed = sum( 1 for op, result in rv if isinstance( result, Exception ) )
+        self.metrics.record( 'backend.write_batch', seconds,
+            error = failed > 0,
+            nbytes = payload_size( [ libplan.op_to_json( op ) for op in ops ] ),
+            items = len( ops ),
+        )
+        return rv
+
+    def set_max_connections( self, count ):
+        self.backend.set_max_connections( count )
+
+    def flush( self ):
+        rv, seconds = self._timed( 'backend.flush', self.backend.flush )
+        self.metrics.record( 'backend.flush', seconds )
+        return rv
+
+    def throttle_errors( self ):
+        return self.backend.throttle_errors()
@@ -0,0 +1,56 @@
+#!/bin/env python3
+
+# Marks the end of the items in a queue
+DONE = object()
+
+
+def run_pipeline( items, stages, depth=2 ):
+    ''' Pass each item through stages, a list of functions called as
+            first stage: result = func( item )
+            later stages: result = func( item, result of the previous stage )
+        Every stage runs in its own thread, so while one stage works on an item,
+        the next stage works on the item before it.
+        The queue in front of each stage holds up to "depth" items,
+        a stage that gets ahead waits for the next one to catch up.
+        Items go through each stage one at a time and in order.
+        The first exception stops the pipeline and is raised.
+        Return list of results of the last stage, in the order of items
+    '''
+    import asyncio
+    return asyncio.run( _pipeline( items, stages, depth ) )
+
+
+async def _pipeline( items, stages, depth ):
+    import asyncio
+    queues = [ asyncio.Queue( maxsize=depth ) for _ in stages ]
+    results = []
+
+    async def feed():
+        for item in items:
+            await queues[0].put( ( item, ) )
+        await queues[0].put( DONE )
+
+    async def work( n, func ):
+        last = n + 1 == len( stages )
+        while True:
+            entry = await queues[n].get()
+            if entry is DONE:
+                break
+            # to_thread() runs func with a copy of the current contextvars
+            rv = await asyncio.to_thread( func, *entry )
+            if last:
+                results.append( rv )
+            else:
+                await queues[n + 1].put( ( entry[0], rv ) )
+        if not last:
+            await queues[n + 1].put( DONE )
+
+    tasks = [ asyncio.create_task( feed() ) ]
+    tasks.extend( asyncio.create_task( work( n, func ) ) for n, func in enumerate( stages ) )
+    try:
+        await asyncio.gather( *tasks )
+    except BaseException:
+        for t in tasks:
+            t.cancel()
+        raise
+    return results
@@ -0,0 +1,202 @@
+#!/bin/env python3
+
+import collections
+import datetime
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import threading
+
+import libstore
+
+# Bump when the plan file layout changes
+VERSION = 1
+
+ACTIONS = ( 'create', 'update', 'noop' )
+
+
+def to_date( value ):
+    ''' datetime.date from a date, datetime or pandas.Timestamp
+    '''
+    if isinstance( value, datetime.datetime ):
+        return value.date()
+    return value
+
+
+def to_datetime( value ):
+    ''' Naive datetime.datetime from a date, datetime or pandas.Timestamp
+    '''
+    if isinstance( value, datetime.datetime ):
+        return datetime.datetime( value.year, value.month, value.day, value.hour, value.minute, value.second )
+    return datetime.datetime.combine( value, datetime.time() )
+
+
+def state_hash( typ, date, attendees ):
+    ''' Stable hash of the desired state of the event of type typ on date
+    '''
+    data = json.dumps( [ typ, to_date( date ).isoformat(), sorted( attendees ) ] )
+    return hashlib.sha1( data.encode() ).hexdigest()
+
+
+def mk_create_op( typ, date, subject, start, attendees, location, categories, end=None, all_day=False, free=False ):
+    ''' Describe a new calendar event to be created
+        typ = event type, such as 'TRIAGE' or 'HANDOFF'
+        date = date of the event (used for matching and reporting)
+        start, end = datetime (end is ignored for all day events)
+    '''
+    return {
+        'action': 'create',
+        'type': typ,
+        'date': to_date( date ),
+        'subject': subject,
+        'start': to_datetime( start ),
+        'end': to_datetime( end ) if end else None,
+        'all_day': all_day,
+        'free': free,
+        'attendees': list( attendees ),
+        'location': location,
+        'categories': list( categories ),
+        'hash': state_hash( typ, date, attendees ),
+    }
+
+
+def mk_update_op( typ, date, event, attendees ):
+    ''' Describe a change to the attendee list of an existing calendar event
+        event = libstore.EventRecord
+    '''
+    return {
+        'action': 'update',
+        'type': typ,
+        'date': to_date( date ),
+        'event': event,
+        'attendees': list( attendees ),
+        'hash': state_hash( typ, date, attendees ),
+    }
+
+
+def mk_noop( typ, date, event ):
+    ''' Record that the existing event already matches the desired state
+        event = libstore.EventRecord
+    '''
+    return {
+        'action': 'noop',
+        'type': typ,
+        'date': to_date( date ),
+        'event': event,
+    }
+
+
+def summary( ops ):
+    ''' Count of ops per action, e.g. { 'create': 3, 'update': 1, 'noop': 40 }
+    '''
+    counts = collections.Counter( op['action'] for op in ops )
+    return { action: counts[action] for action in ACTIONS }
+
+
+def changes( ops ):
+    ''' The ops that would modify the calendar
+    '''
+    return [ op for op in ops if op['action'] != 'noop' ]
+
+
+def overlay( existing_events, ops ):
+    ''' Existing events as they will be after "create" ops are executed
+        existing_events = dict with keys=DATE and values={ TYPE: event }
+        Return a new dict, existing_events is not modified
+    '''
+    content = { date: dict( sub ) for date, sub in existing_events.items() }
+    for op in ops:
+        if op['action'] == 'create':
+            content.setdefault( op['date'], {} )[ op['type'] ] = libstore.EventRecord.from_op( op )
+    return content
+
+
+class HashStore( object ):
+    ''' Local record of the desired state hash last confirmed for each event,
+        together with the event changekey at that time.
+        An event whose changekey still matches has not been modified since,
+        so a matching hash means the event needs no further checks.
+    '''
+
+    def __init__( self, path ):
+        self.path = pathlib.Path( path )
+        self.hashes = {}
+        self.changed = False
+        self.lock = threading.Lock()
+        try:
+            self.hashes = json.loads( self.path.read_text() )
+        except FileNotFoundError:
+            pass
+        except ValueError as e:
+            logging.warning( f'Ignoring unreadable hash file "{self.path}": {e}' )
+
+    def is_current( self, event, desired_hash ):
+        ''' True if event (a libstore.EventRecord) is known to be in the desired state
+        '''
+        if not event.item_id:
+            return False
+        # only a changekey recorded here proves nobody edited the event since;
+        # the hash stored on the event survives edits in Outlook
+        return self.hashes.get( event.item_id ) == [ desired_hash, event.changekey ]
+
+    def put( self, item_id, desired_hash, changekey ):
+        if item_id and desired_hash:
+            with self.lock:
+                self.hashes[ item_id ] = [ desired_hash, changekey ]
+                self.changed = True
+
+    def save( self ):
+        with self.lock:
+            if self.changed:
+                self.path.parent.mkdir( parents=True, exist_ok=True )
+                tmp = self.path.with_name( self.path.name + '.tmp' )
+                tmp.write_text( json.dumps( self.hashes ) )
+                os.replace( tmp, self.path )
+                self.changed = False
+
+
+def op_to_json( op ):
+    data = {}
+    for key, val in op.items():
+        if key == 'event':
+            val = val.to_json()
+        elif isinstance( val, datetime.date ):
+            val = val.isoformat()
+        data[key] = val
+    return data
+
+
+def op_from_json( data ):
+    op = dict( data )
+    op['date'] = datetime.date.fromisoformat( op['date'] )
+    for key in ( 'start', 'end' ):
+        if op.get( key ):
+            op[key] = datetime.datetime.fromisoformat( op[key] )
+    if 'event' in op:
+        op['event'] = libstore.EventRecord.from_json( op['event'] )
+    return op
+
+
+def write_plan( path, ops, **meta ):
+    ''' Save ops to a JSON file
+        meta = extra information to store with the plan, such as the date range
+    '''
+    data = {
+        'version': VERSION,
+        'created': datetime.datetime.now().isoformat( timespec='seconds' ),
+        'summary': summary( ops ),
+        'ops': [ op_to_json( op ) for op in ops ],
+    }
+    data.update( { k: str( v ) for k, v in meta.items() } )
+    pathlib.Path( path ).write_text( json.dumps( data, indent=1 ) )
+
+
+def read_plan( path ):
+    ''' Load ops from a JSON file written by write_plan()
+    '''
+    data = json.loads( pathlib.Path( path ).read_text() )
+    if data.get( 'version' ) != VERSION:
+        raise UserWarning( f'Unsupported plan file version in "{path}"' )
+    return [ op_from_json( op ) for op in data['ops'] ]
@@ -0,0 +1,130 @@
+#!/bin/env python3
+
+import concurrent.futures
+import logging
+import random
+import threading
+import time
+
+MAX_BACKOFF = 60
+
+
+def throttle_errors():
+    ''' Exchange responses that mean "slow down", as opposed to a real failure
+        (exchangelib is imported on first use, it is slow to import)
+    '''
+    import exchangelib.errors
+    return (
+        exchangelib.errors.ErrorServerBusy,
+        exchangelib.errors.ErrorTooManyObjectsOpened,
+        exchangelib.errors.ErrorInternalServerTransientError,
+        exchangelib.errors.ErrorTimeoutExpired,
+        exchangelib.errors.RateLimitError,
+    )
+
+
+class AdaptiveLimit( object ):
+    ''' Concurrency cap shared by all workers.
+        Halves when exchange throttles us (and pauses everyone for the back off time),
+        grows by one again after "limit" successful calls in a row, up to "maximum".
+    '''
+
+    def __init__( self, maximum ):
+        self.maximum = maximum
+        self.limit = maximum
+        self.active = 0
+        self.successes = 0
+        self.resume_at = 0
+        self.cond = threading.Condition()
+
+    def acquire( self ):
+        with self.cond:
+            while True:
+                pause = self.resume_at - time.monotonic()
+                if pause > 0:
+                    self.cond.wait( pause )
+                elif self.active >= self.limit:
+                    self.cond.wait()
+                else:
+                    break
+            self.active += 1
+
+    def release( self, back_off=None ):
+        ''' back_off = seconds to pause all workers, if the call was throttled
+        '''
+        with self.cond:
+            self.active -= 1
+            if back_off is not None:
+                self.limit = max( 1, self.limit // 2 )
+                self.successes = 0
+                self.resume_at = max( self.resume_at, time.monotonic() + back_off )
+            else:
+                self.successes += 1
+                if self.limit < self.maximum and self.successes >= self.limit:
+                    self.limit += 1
+                    self.successes = 0
+            self.cond.notify_all()
+
+
+def backoff_delay( err, attempt ):
+    ''' Seconds to wait before retry number "attempt"
+        Use the server supplied value when there is one.
+    '''
+    delay = getattr( err, 'back_off', None )
+    if not delay:
+        delay = 2 ** attempt + random.uniform( 0, 1 )
+    return min( delay, MAX_BACKOFF )
+
+
+def chunks( items, size ):
+    ''' Split list items into consecutive lists of at most size elements
+    '''
+    for i in range( 0, len( items ), size ):
+        yield items[ i : i + size ]
+
+
+def run_parallel( func, items, jobs, retries=5, retry_on=None, on_retry=None ):
+    ''' Call func( item ) for each item using up to "jobs" threads.
+        Throttling errors (retry_on, default throttle_errors()) are retried
+        (up to "retries" times per item) with back off,
+        any other exception is returned as the result for that item.
+        on_retry = function( item, error ), called before each retry
+        Return list of ( item, result ) in the same order as items
+    '''
+    return list( iter_parallel( func, items, jobs, retries, retry_on, on_retry ) )
+
+
+def iter_parallel( func, items, jobs, retries=5, retry_on=None, on_retry=None ):
+    ''' Same as run_parallel(), but yield each ( item, result ) in order
+        as soon as it (and every item before it) is done
+    '''
+    limit = AdaptiveLimit( max( 1, jobs ) )
+    throttled = throttle_errors() if retry_on is None else retry_on
+
+    def worker( item ):
+        attempt = 0
+        while True:
+            limit.acquire()
+            try:
+                rv = func( item )
+            except throttled as e:
+                attempt += 1
+                delay = backoff_delay( e, attempt )
+                limit.release( back_off=delay )
+                if attempt > retries:
+                    return e
+                if on_retry:
+                    on_retry( item, e )
+                logging.warning(
+                    f'Calendar is throttling ({type(e).__name__}), '
+                    f'retry in {delay:.1f}s with at most {limit.limit} parallel jobs'
+                )
+                continue
+            except Exception as e:
+                limit.release()
+                return e
+            limit.release()
+            return rv
+
+    with concurrent.futures.ThreadPoolExecutor( max_workers=limit.maximum ) as pool:
+        yield from zip( items, pool.map( worker, items ) )
@@ -0,0 +1,188 @@
+#!/bin/env python3
+
+import csv
+import json
+
+# Columns of the --triage_report rows
+FIELDS = ( 'date', 'start', 'type', 'subject', 'attendees', 'item_id' )
+
+
+def event_row( e ):
+    ''' dict with FIELDS for a libstore.EventRecord
+    '''
+    return {
+        'date': e.date.isoformat(),
+        'start': e.start.isoformat(),
+        'type': e.type,
+        'subject': e.subject,
+        'attendees': list( e.attendees ),
+        'item_id': e.item_id,
+    }
+
+
+def write_jsonl( chunks, fh ):
+    ''' Write one JSON object per event, as each chunk of events arrives
+        chunks = iterable of lists of libstore.EventRecords
+        Return number of events written
+    '''
+    count = 0
+    for events in chunks:
+        for e in events:
+            fh.write( json.dumps( event_row( e ) ) + '\n' )
+        fh.flush()
+        count += len( events )
+    return count
+
+
+def write_csv( chunks, fh ):
+    ''' Same as write_jsonl(), as CSV with a header row
+        (attendees are separated by ";")
+    '''
+    writer = csv.writer( fh )
+    writer.writerow( FIELDS )
+    count = 0
+    for events in chunks:
+        for e in events:
+            row = event_row( e )
+            row['attendees'] = ';'.join( row['attendees'] )
+            writer.writerow( [ row[k] for k in FIELDS ] )
+        fh.flush()
+        count += len( events )
+    return count
+
+
+def fairness( triage_events, handoff_events, people, teams, emails, managers, workday_index ):
+    ''' Duty statistics over existing events
+        triage_events, handoff_events = lists of libstore.EventRecords
+        people = staff names (rows of the duty table, others are added as found)
+        teams = rotation the schedule should follow (libgroup.FairTeams)
+        emails = dict of name -> email, to recognise attendees
+        managers = manager names
+        workday_index = function, array of dates -> array of work day numbers
+        Return dict with
+            'duty': list of { name, duties, last, min_gap, mean_gap } per person
+            'gaps': { 'histogram': { gap: count }, 'min', 'p25', 'median', 'mean', 'p75', 'max' }
+                    where gaps are counted in work days
+            'swaps': list of { date, team, expected } where the team differs from the rotation
+            'handoff_load': list of { name, handoffs } per manager
+    '''
+    import numpy
+    names = { email.lower(): name for name, email in emails.items() }
+    triage_events = sorted( triage_events, key=lambda e: e.start )
+    teams_found = [ tuple( names.get( a.lower(), a ) for a in e.attendees ) for e in triage_events ]
+
+    # one ( person, work day ) pair per duty
+    people = list( people )
+    rows = { name: i for i, name in enumerate( people ) }
+    for team in teams_found:
+        for name in team:
+            if name not in rows:
+                rows[name] = len( people )
+                people.append( name )
+    days = workday_index( numpy.array( [ e.date for e in triage_events ], dtype='datetime64[D]' ) )
+    sizes = [ len( team ) for team in teams_found ]
+    person = numpy.fromiter( ( rows[name] for team in teams_found for name in team ), dtype=int, count=sum( sizes ) )
+    day = numpy.repeat( numpy.asarray( days, dtype=int ), sizes )
+    dates = numpy.repeat( numpy.array( [ e.date for e in triage_events ], dtype='datetime64[D]' ), sizes )
+
+    counts = numpy.bincount( person, minlength=len( people ) )
+    order = numpy.lexsort( ( day, person ) )
+    person, day, dates = person[order], day[order], dates[order]
+    same = person[1:] == person[:-1]
+    gaps = numpy.diff( day )[same]
+    gap_owner = person[1:][same]
+    gap_count = numpy.bincount( gap_owner, minlength=len( people ) )
+    gap_sum = numpy.bincount( gap_owner, weights=gaps, minlength=len( people ) )
+    gap_min = numpy.full( len( people ), numpy.iinfo( int ).max )
+    numpy.minimum.at( gap_min, gap_owner, gaps )
+    # last duty of each person: the last of their ( person, day ) pairs
+    ends = numpy.flatnonzero( numpy.append( ~same, True ) ) if len( person ) else person
+    last = dict( zip( person[ends].tolist(), dates[ends].tolist() ) )
+    duty = []
+    for i, name in enumerate( people ):
+        duty.append( {
+            'name': name,
+            'duties': int( counts[i] ),
+            'last': last[i].isoformat() if i in last else None,
+            'min_gap': int( gap_min[i] ) if gap_count[i] else None,
+            'mean_gap': round( float( gap_sum[i] / gap_count[i] ), 2 ) if gap_count[i] else None,
+        } )
+
+    gap_stats = { 'histogram': {} }
+    if len( gaps ):
+        values, freq = numpy.unique( gaps, return_counts=True )
+        gap_stats['histogram'] = { int( v ): int( f ) for v, f in zip( values, freq ) }
+        p25, median, p75 = numpy.percentile( gaps, [ 25, 50, 75 ] )
+        gap_stats.update(
+            min = int( gaps.min() ),
+            p25 = float( p25 ),
+            median = float( median ),
+            mean = round( float( gaps.mean() ), 2 ),
+            p75 = float( p75 ),
+            max = int( gaps.max() ),
+        )
+
+    # position of each event in the rotation, -1 for teams that are not in it
+    index = teams.team_index()
+    idx = numpy.array( [ index.get( frozenset( team ), -1 ) for team in teams_found ], dtype=int )
+    swaps = []
+    known = numpy.flatnonzero( idx >= 0 )
+    if len( known ):
+        # align the rotation where most events match it
+        start = numpy.bincount( ( idx[known] - known ) % len( teams ) ).argmax()
+        expected = ( start + numpy.arange( len( idx ) ) ) % len( teams )
+        for n in numpy.flatnonzero( idx != expected ).tolist():
+            swaps.append( {
+                'date': triage_events[n].date.isoformat(),
+                'team': list( teams_found[n] ),
+                'expected': list( teams[ int( expected[n] ) ] ),
+            } )
+
+    managers = list( managers )
+    load = dict.fromkeys( managers, 0 )
+    manager_emails = { emails[m].lower(): m for m in managers if m in emails }
+    for e in handoff_events:
+        for a in e.attendees:
+            m = manager_emails.get( a.lower() )
+            if m:
+                load[m] += 1
+    return {
+        'duty': duty,
+        'gaps': gap_stats,
+        'swaps': swaps,
+        'handoff_load': [ { 'name': m, 'handoffs': n } for m, n in load.items() ],
+    }
+
+
+def write_fairness_text( report, fh ):
+    fh.write( f'{"name":<24} {"duties":>6} {"last":>10} {"min_gap":>7} {"mean_gap":>8}\n' )
+    for r in report['duty']:
+        last = r['last'] or '-'
+        min_gap = '-' if r['min_gap'] is None else r['min_gap']
+        mean_gap = '-' if r['mean_gap'] is None else r['mean_gap']
+        fh.write( f'{r["name"]:<24} {r["duties"]:>6} {last:>10} {min_gap:>7} {mean_gap:>8}\n' )
+    gaps = report['gaps']
+    fh.write( '\nGaps between duties (work days):\n' )
+    if gaps['histogram']:
+        fh.write( f'  min {gaps["min"]}  p25 {gaps["p25"]}  median {gaps["median"]}'
+                  f'  mean {gaps["mean"]}  p75 {gaps["p75"]}  max {gaps["max"]}\n' )
+        for gap, count in gaps['histogram'].items():
+            fh.write( f'  {gap:>4} {count:>5}\n' )
+    fh.write( f'\nTeams differing from the rotation: {len( report["swaps"] )}\n' )
+    for s in report['swaps']:
+        fh.write( f'  {s["date"]} {s["team"]} expected {s["expected"]}\n' )
+    fh.write( '\nHandoff load per manager:\n' )
+    for r in report['handoff_load']:
+        fh.write( f'  {r["name"]:<24} {r["handoffs"]:>5}\n' )
+
+
+def write_fairness_jsonl( report, fh ):
+    ''' One JSON object per line, with "section" set to the report key
+    '''
+    for r in report['duty']:
+        fh.write( json.dumps( dict( section='duty', **r ) ) + '\n' )
+    fh.write( json.dumps( dict( section='gaps', **report['gaps'] ) ) + '\n' )
+    for r in report['swaps']:
+        fh.write( json.dumps( dict( section='swaps', **r ) ) + '\n' )
+    for r in report['handoff_load']:
+        fh.write( json.dumps( dict( section='handoff_load', **r ) ) + '\n' )
@@ -0,0 +1,92 @@
+#!/bin/env python3
+
+import csv
+import logging
+
+import libdate
+
+
+def read_absences( filename ):
+    ''' Read a PTO / absence CSV file with headers "name", "start", "end"
+        Dates are YYYY-MM-DD, "end" is inclusive and may be empty for a single day.
+        Return list of ( name, start, end ) with datetime.date values
+    '''
+    absences = []
+    with open( filename, newline='' ) as fh:
+        for row in csv.DictReader( fh, skipinitialspace=True ):
+            row = { k.strip().lower(): ( v or '' ).strip() for k, v in row.items() if k }
+            if not row.get( 'name' ):
+                continue
+            start = libdate.parse_date( row['start'] )
+            end = libdate.parse_date( row['end'] ) if row.get( 'end' ) else start
+            absences.append( ( row['name'], start, end ) )
+    return absences
+
+
+def availability_bitmap( people, workdays, absences ):
+    ''' Boolean person x workday array, True where the person is available
+        people = list of names (row order)
+        workdays = sorted list of datetime.date (column order)
+        absences = list of ( name, start, end ), see read_absences()
+    '''
+    import numpy
+    days = numpy.array( workdays, dtype='datetime64[D]' )
+    bitmap = numpy.ones( ( len( people ), len( days ) ), dtype=bool )
+    rows = { name: i for i, name in enumerate( people ) }
+    for name, start, end in absences:
+        if name not in rows:
+            logging.warning( f'Ignoring absence for unknown staff member "{name}"' )
+            continue
+        lo = numpy.searchsorted( days, numpy.datetime64( start, 'D' ), side='left' )
+        hi = numpy.searchsorted( days, numpy.datetime64( end, 'D' ), side='right' )
+        bitmap[ rows[name], lo:hi ] = False
+    return bitmap
+
+
+def assign_teams( teams, workdays, people, bitmap ):
+    ''' Assign one team to each workday, following the rotation order of teams.
+        If the next team in the rotation has someone unavailable on a day,
+        the available team (from the rest of the rotation) whose members have
+        gone longest without duty is moved ahead of it, so the skipped team
+        is first in line again on the following day.
+        teams = rotation of tuples of names, all of the same size (anything
+                indexable, such as libgroup.FairTeams)
+        workdays = list of dates
+        people = list of names, the rows of bitmap
+        bitmap = output of availability_bitmap()
+        Return list of ( day, team ) in workday order
+    '''
+    import numpy
+    rows = { name: i for i, name in enumerate( people ) }
+    # bitmap rows of the members of each team of the rotation
+    team_rows = numpy.array( [ [ rows[name] for name in team ] for team in teams ], dtype=numpy.intp )
+    # order of the rotation, as indexes into teams: order[ ( head + j ) % len( order ) ]
+    # is j-th in line; every team is in it once
+    order = numpy.arange( len( team_rows ) )
+    head = 0
+    # workday index of the last duty of each person
+    never = -len( workdays ) - len( order )
+    last_duty = numpy.full( len( people ), never, dtype=numpy.int64 )
+    assignments = []
+    for d, day in enumerate( workdays ):
+        available = bitmap[ :, d ]
+        if not available[ team_rows[ order[head] ] ].all():
+            line = numpy.roll( order, -head )
+            members = team_rows[line]
+            free = available[members].all( axis=1 )
+            free[0] = False
+            if not free.any():
+                logging.warning( f'No fully available team on {day}, keeping {teams[ int( line[0] ) ]}' )
+            else:
+                # days since the most recent duty of any member, the first of the longest wins
+                gap = numpy.where( free, d - last_duty[members].max( axis=1 ), never - 1 )
+                chosen = int( gap.argmax() )
+                logging.info( f'Team {teams[ int( line[0] ) ]} unavailable on {day}, using {teams[ int( line[chosen] ) ]}' )
+                # move the chosen team ahead of the ones it passed
+                ahead = ( head + numpy.arange( chosen + 1 ) ) % len( order )
+                order[ahead] = numpy.roll( order[ahead], 1 )
+        slot = int( order[head] )
+        last_duty[ team_rows[slot] ] = d
+        head = ( head + 1 ) % len( order )
+        assignments.append( ( day, teams[slot] ) )
+    return assignments
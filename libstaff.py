@@ -0,0 +1,112 @@
+#!/bin/env python3
+
+import csv
+import logging
+import os
+
+# Hash to hold module level data
+resources = {}
+
+TYPES = ( 'staff', 'manager' )
+
+# DOW letters, index = date.weekday()
+DAYCHARS = ( 'M', 'T', 'W', 'R', 'F', )
+
+# Columns every staff file must have (any case), "DOW" is optional
+COLUMNS = ( 'name', 'email', 'type' )
+
+
+class Person( object ):
+    ''' One row of the staff file
+        (attribute names follow the CSV headers, as the old namedtuple rows did)
+        DOW = days on duty as a manager, letters from DAYCHARS
+    '''
+    __slots__ = ( 'Name', 'Email', 'Type', 'DOW' )
+
+    def __init__( self, Name, Email, Type, DOW='' ):
+        self.Name = Name
+        self.Email = Email
+        self.Type = Type
+        self.DOW = DOW
+
+    def __repr__( self ):
+        return f'Person( {self.Name}, {self.Email}, {self.Type}, {self.DOW} )'
+
+
+class StaffRegistry( object ):
+    ''' Validated contents of a staff file, with the lookups the scheduler needs
+        staff = dict with keys=Name and values=Person, type 'staff', in file order
+        managers = dict with keys=Name and values=Person, type 'manager'
+        emails = dict with keys=Name and values=Email, everyone
+        mods = tuple (index = date.weekday()) of tuples of managers on duty
+        mod_emails = same as mods, with the manager emails
+    '''
+
+    def __init__( self, people ):
+        self.staff = { p.Name: p for p in people if p.Type == 'staff' }
+        self.managers = { p.Name: p for p in people if p.Type == 'manager' }
+        self.emails = { p.Name: p.Email for p in people }
+        table = [ [] for _ in range( 7 ) ]
+        for mgr in self.managers.values():
+            for dow_char in mgr.DOW:
+                table[ DAYCHARS.index( dow_char ) ].append( mgr )
+        self.mods = tuple( tuple( mgrs ) for mgrs in table )
+        self.mod_emails = tuple( tuple( m.Email for m in mgrs ) for mgrs in self.mods )
+
+
+def get_registry( filename ):
+    ''' StaffRegistry for filename, parsed again only when the file changes
+    '''
+    mtime = os.stat( filename ).st_mtime_ns
+    cached = resources.get( filename )
+    if cached is None or cached[0] != mtime:
+        logging.debug( f'Loading staff from "{filename}"' )
+        cached = ( mtime, StaffRegistry( read_staff( filename ) ) )
+        resources[filename] = cached
+    return cached[1]
+
+
+def read_staff( filename ):
+    ''' Parse and validate a staff CSV file (delimiter is detected from the header)
+        Raise UserWarning listing every problem found
+        Return list of Persons in file order
+    '''
+    with open( filename, newline='' ) as fh:
+        dialect = csv.Sniffer().sniff( fh.readline(), delimiters=',;\t|' )
+        fh.seek( 0 )
+        reader = csv.reader( fh, dialect, skipinitialspace=True )
+        header = [ h.strip().lower() for h in next( reader, [] ) ]
+        missing = [ c for c in COLUMNS if c not in header ]
+        if missing:
+            raise UserWarning( f'{filename}: missing columns: {", ".join( missing )}' )
+        cols = [ header.index( c ) for c in COLUMNS ]
+        dow_col = header.index( 'dow' ) if 'dow' in header else None
+        people = []
+        errors = []
+        names = set()
+        emails = set()
+        for r in reader:
+            if not any( v.strip() for v in r ):
+                continue
+            r = [ v.strip() for v in r ] + [ '' ] * len( header )
+            name, email, typ = ( r[i] for i in cols )
+            typ = typ.lower()
+            dow = r[dow_col].upper() if dow_col is not None else ''
+            where = f'{filename}:{reader.line_num}'
+            if typ not in TYPES:
+                errors.append( f'{where}: unknown Type "{typ}", expected one of {", ".join( TYPES )}' )
+            bad = [ c for c in dow if c not in DAYCHARS ]
+            if bad:
+                errors.append( f'{where}: bad DOW letters "{"".join( bad )}", expected any of {"".join( DAYCHARS )}' )
+            if not name or not email:
+                errors.append( f'{where}: missing Name or Email' )
+            if name in names:
+                errors.append( f'{where}: duplicate Name "{name}"' )
+            if email.lower() in emails:
+                errors.append( f'{where}: duplicate Email "{email}"' )
+            names.add( name )
+            emails.add( email.lower() )
+            people.append( Person( name, email, typ, dow ) )
+    if errors:
+        raise UserWarning( 'Invalid staff file:\n' + '\n'.join( errors ) )
+    return people
@@ -0,0 +1,143 @@
+#!/bin/env python3
+
+import datetime
+import logging
+import re
+import threading
+
+
+class SyncStateExpired( Exception ):
+    ''' The calendar no longer accepts this sync state, a full sync is needed
+    '''
+    pass
+
+
+def compile_regex_map( regex_map ):
+    return { typ: re.compile( pattern ) for typ, pattern in regex_map.items() }
+
+
+def classify( regexes, subject ):
+    ''' Event type for subject, None if the event is not one of ours
+        regexes = output of compile_regex_map()
+    '''
+    for typ, regex in regexes.items():
+        if subject and regex.search( subject ):
+            return typ
+    return None
+
+
+class EventRecord( object ):
+    ''' Compact copy of the calendar event fields used by the scheduler
+        start = naive local datetime
+        attendees = tuple of required attendee email addresses
+        state_hash = desired state hash stored on the event, see libplan.state_hash()
+    '''
+    __slots__ = ( 'date', 'start', 'type', 'subject', 'attendees', 'item_id', 'changekey', 'state_hash' )
+
+    def __init__( self, start, typ, subject, attendees, item_id=None, changekey=None, state_hash=None ):
+        if not isinstance( start, datetime.datetime ):
+            start = datetime.datetime.combine( start, datetime.time() )
+        self.date = start.date()
+        self.start = start
+        self.type = typ
+        self.subject = subject
+        self.attendees = tuple( attendees )
+        self.item_id = item_id
+        self.changekey = changekey
+        self.state_hash = state_hash
+
+    @classmethod
+    def from_op( cls, op, item_id=None, changekey=None ):
+        ''' Record for an event created by executing a "create" op
+        '''
+        return cls( op['start'], op['type'], op['subject'], op['attendees'], item_id, changekey, op.get( 'hash' ) )
+
+    def to_json( self ):
+        return {
+            'start': self.start.isoformat(),
+            'type': self.type,
+            'subject': self.subject,
+            'attendees': list( self.attendees ),
+            'item_id': self.item_id,
+            'changekey': self.changekey,
+            'state_hash': self.state_hash,
+        }
+
+    @classmethod
+    def from_json( cls, data ):
+        return cls(
+            start = datetime.datetime.fromisoformat( data['start'] ),
+            typ = data['type'],
+            subject = data['subject'],
+            attendees = data['attendees'],
+            item_id = data['item_id'],
+            changekey = data['changekey'],
+            state_hash = data.get( 'state_hash' ),
+        )
+
+    def __repr__( self ):
+        return f'EventRecord( {self.start}, {self.type}, {self.subject} )'
+
+
+class EventStore( object ):
+    ''' In process copy of the existing calendar events.
+        Events are fetched (using "loader") the first time they are needed,
+        then kept up to date with the changes this process makes,
+        so later steps don't have to fetch them again.
+    '''
+
+    def __init__( self, loader ):
+        ''' loader = function returning a list of EventRecords
+        '''
+        self.loader = loader
+        self.events = None
+        self.lock = threading.Lock()
+
+    def by_date( self ):
+        ''' Return dict with keys=DATE and values={ TYPE: event }
+            Fetch events from exchange if not already loaded.
+        '''
+        with self.lock:
+            if self.events is None:
+                self._load()
+            return self.events
+
+    def _load( self ):
+        self.events = {}
+        for e in self.loader():
+            self._put( e )
+
+    def _put( self, event ):
+        self.events.setdefault( event.date, {} )[event.type] = event
+
+    def invalidate( self ):
+        ''' Forget all events; the next by_date() fetches them again
+        '''
+        with self.lock:
+            self.events = None
+
+    def refresh( self ):
+        ''' Fetch all events again now
+        '''
+        with self.lock:
+            self._load()
+        return self.events
+
+    def apply( self, op, result=None ):
+        ''' Record a successfully executed create or update op
+            result = ( item_id, changekey ) if known
+        '''
+        with self.lock:
+            if self.events is None:
+                # nothing loaded yet, the next fetch will include this change
+                return
+            if op['action'] == 'create':
+                item_id, changekey = result if result else ( None, None )
+                self._put( EventRecord.from_op( op, item_id, changekey ) )
+            else:
+                event = op['event']
+                event.attendees = tuple( op['attendees'] )
+                event.state_hash = op.get( 'hash' )
+                if result:
+                    event.item_id, event.changekey = result
+            logging.debug( f'Event store: {op["action"]} {op["type"]} on "{op["date"]}"' )
@@ -0,0 +1,34 @@
+#!/bin/env python3
+
+import logging
+import os
+
+
+class FileWatcher( object ):
+    ''' Notice changes to a set of files by polling their modification times
+    '''
+
+    def __init__( self, files ):
+        ''' files = dict with keys=NAME and values=path (or None to skip)
+        '''
+        self.files = { name: path for name, path in files.items() if path }
+        self.mtimes = { name: self.mtime( path ) for name, path in self.files.items() }
+
+    @staticmethod
+    def mtime( path ):
+        try:
+            return os.stat( path ).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def changed( self ):
+        ''' Return set of the names of files changed since the previous call
+        '''
+        names = set()
+        for name, path in self.files.items():
+            mtime = self.mtime( path )
+            if mtime != self.mtimes[name]:
+                logging.info( f'File changed: {name} "{path}"' )
+                self.mtimes[name] = mtime
+                names.add( name )
+        return names
@@ -1,21 +1,64 @@
 #!/bin/env python3
 
 import argparse
-import collections
-import csv
+import bisect
+import contextlib
+import contextvars
 import datetime
+import hashlib
+import json
 import logging
 import os
-import pandas
 import pathlib
 import pprint
-import pyexch.pyexch
+import re
+import sys
+import threading
+import time
 
+# pandas, numpy, asyncio and exchangelib (via pyexch and libexch) are slow to
+# import; the lib modules import them inside the functions that use them, and
+# run.py only where they are needed, so offline commands such as --list_teams start fast.
+import libbackend
+import libcache
+import libconfig
 import libdate
 import libgroup
+import libjournal
+import libmetrics
+import libpipeline
+import libplan
+import libpool
+import libreport
+import libsolve
+import libstaff
+import libstore
+import libwatch
 
 # Hash to hold module level data
 resources = {}
+resources_lock = threading.Lock()
+
+# The --config group being worked on, see use_group()
+# (None: settings from the command line and environment)
+current_group = contextvars.ContextVar( 'current_group', default=None )
+
+# Seconds between input file checks with --serve
+FILE_POLL = 5
+
+# Chunks of dates waiting between two --pipeline stages
+PIPELINE_DEPTH = 2
+
+# Days before START searched for the latest TRIAGE event with --continue
+CONTINUE_LOOKBACK = 90
+
+# Cached input data to drop when a watched file changes, see reset_inputs()
+INPUT_KEYS = {
+    'staff': ( 'staff_registry', ), # libstaff only parses the file again if it changed
+    'pto': ( 'absences', ),
+    'location': ( 'triage_location', ),
+    'holidays': (), # libdate notices changes itself
+}
 
 def get_args():
     if 'args' not in resources:
@@ -25,13 +68,19 @@ def get_args():
             'epilog': '''
 ENVIRONMENT VARIABLES:
        TRIAGE_STAFF_FILE: Path to a file containing staff
-                          File format is CSV with headers "name", "email", "type",
-                          where "type" is one of 'staff', 'manager'.
+                          File format is CSV with headers "name", "email", "type", "dow",
+                          where "type" is one of 'staff', 'manager'
+                          and "dow" lists the manager duty days, letters from MTWRF.
+                          Checked when loaded: unknown types, bad DOW letters,
+                          duplicate names and emails are errors.
     TRIAGE_LOCATION_FILE: Path to a file containing a URL for an online meeting
                           Used in the "location" field in newly created exchange calendar events
     TRIAGE_HOLIDAYS_FILE: Path to a file containing a list of holidays to be excluded from scheduling
                           File format is CSV with one header "date"
                           Dates should be in the form of YYYY-MM-DD
+         TRIAGE_PTO_FILE: (optional) Path to a file listing staff absences
+                          File format is CSV with headers "name", "start", "end"
+                          Dates should be in the form of YYYY-MM-DD, "end" is inclusive
        OAUTH_CONFIG_FILE: Path to the pyexch config file
                           (See: https://github.com/andylytical/pyexch)
         OAUTH_TOKEN_FILE: Path to the pyexch token file
@@ -39,7 +88,13 @@ ENVIRONMENT VARIABLES:
                    NETRC: Alternate path to a netrc file (default is ~/.netrc)
                           (See also: https://github.com/andylytical/pyexch)
        PYEXCH_REGEX_JSON: Alternate regex for matching existing calendar events
+                          JSON object like {"TRIAGE": "^Triage: ", "HANDOFF": "^Triage Hand-Off"}
+                          (not used with --config, set regex_map per group instead)
                           (See also: https://github.com/andylytical/pyexch)
+       TRIAGE_CACHE_FILE: Path to the local calendar cache
+                          (default: ~/.cache/asd-triage-scheduler/events.json)
+                          A suffix for the backend, --config and the event regexes
+                          is added to the file name, e.g. events-1a2b3c4d.json
             '''
         }
         parser = argparse.ArgumentParser( **constructor_args )
@@ -52,6 +107,84 @@ ENVIRONMENT VARIABLES:
             )
         parser.add_argument( '--start', help='Start date (default: today).' )
         parser.add_argument( '--end', help='End date (default: start + 90 days).' )
+        parser.add_argument( '--backend',
+                choices=( 'exchange', 'fake', 'ics' ),
+                default='exchange',
+                help=(
+                    'Calendar to use. "fake" is an empty in-memory calendar'
+                    '\nfor offline runs (see bench.py). "ics" reads existing events'
+                    '\nfrom --ics_file and writes new and updated events back to it.'
+                    '\n(default: exchange)'
+                    ),
+            )
+        parser.add_argument( '--ics_file', metavar='FILE',
+                help='iCalendar file for --backend ics (created if missing).',
+            )
+        parser.add_argument( '--no_cache', action='store_true',
+                help='Fetch events directly from exchange, do not use the local calendar cache.',
+            )
+        parser.add_argument( '--refresh', action='store_true',
+                help='Discard the local calendar cache and download all events again.',
+            )
+        parser.add_argument( '--fetch_window',
+                default='MS',
+                help=(
+                    'With --no_cache, fetch events in windows split at this pandas'
+                    '\nfrequency, e.g. "MS" (month), "QS" (quarter), "W" (week).'
+                    '\nWindows are fetched in parallel when --jobs is set.'
+                    '\nAlso the size of the --pipeline chunks.'
+                    '\n(default: MS)'
+                    ),
+            )
+        parser.add_argument( '--batch_size',
+                type=int,
+                default=0,
+                help=(
+                    'Send calendar creates and updates in bulk requests'
+                    '\nof up to BATCH_SIZE events each.'
+                    '\n(default: 0, one request per event)'
+                    ),
+            )
+        parser.add_argument( '-j', '--jobs',
+                type=int,
+                default=1,
+                help=(
+                    'Run up to JOBS calendar requests in parallel.'
+                    '\nParallelism is reduced automatically while exchange is throttling.'
+                    '\n(default: 1)'
+                    ),
+            )
+        parser.add_argument( '--pipeline', action='store_true',
+                help=(
+                    'With --mktriage / --mkhandoff, work through the dates in'
+                    '\n--fetch_window sized chunks: fetch the next chunk, plan the'
+                    '\ncurrent one and apply the previous one at the same time.'
+                    ),
+            )
+        parser.add_argument( '--config', metavar='FILE',
+                help=(
+                    'YAML file listing several triage groups, each with its own'
+                    '\nstaff file, subject prefix, regexes and location'
+                    '\n(see README). The selected modes run for every group,'
+                    '\nsharing one calendar session and one calendar fetch.'
+                    ),
+            )
+        parser.add_argument( '--subject_prefix',
+                default='Triage',
+                help=(
+                    'Start of the event subjects, "PREFIX: names" for triage'
+                    '\nand "PREFIX Hand-Off" for handoff events. (default: Triage)'
+                    ),
+            )
+        parser.add_argument( '--metrics', metavar='OUTFILE',
+                help=(
+                    'Write counts, latencies, retries and payload sizes of calendar calls'
+                    '\nand local stages to OUTFILE (JSON) at the end of the run.'
+                    ),
+            )
+        parser.add_argument( '--metrics_textfile', metavar='OUTFILE',
+                help='Also write the metrics in prometheus textfile collector format.',
+            )
 
         # List Options
         g_list = parser.add_argument_group( title='List Duty Teams' )
@@ -78,6 +211,22 @@ ENVIRONMENT VARIABLES:
         g_triage.add_argument( '--triage_report', action='store_true',
                 help='Report on existing triage events between START and END.',
             )
+        g_triage.add_argument( '--report_format',
+                choices=( 'text', 'jsonl', 'csv' ),
+                default='text',
+                help=(
+                    'Output of --triage_report and --fairness_report (default: text).'
+                    '\njsonl and csv rows are written as events arrive from the calendar.'
+                    '\n(--fairness_report supports text and jsonl)'
+                    ),
+            )
+        g_triage.add_argument( '--fairness_report', action='store_true',
+                help=(
+                    'Report on existing events between START and END: duties per person,'
+                    '\ngaps between duties (work days), teams that differ from the'
+                    '\nrotation (manual swaps), and handoffs per manager.'
+                    ),
+            )
         g_triage.add_argument( '--start_at',
                 type=int,
                 default=0,
@@ -87,9 +236,30 @@ ENVIRONMENT VARIABLES:
                     '\nUse the --list_teams option to see the team list and indices.'
                     ),
             )
+        g_triage.add_argument( '--continue',
+                dest='continue_rotation',
+                action='store_true',
+                help=(
+                    'Instead of --start_at, start with the team after the one of the'
+                    f'\nlatest TRIAGE event in the {CONTINUE_LOOKBACK} days before START.'
+                    '\nA team that is not in the rotation (manual swap) counts as'
+                    '\nthe rotation team with the most members in common.'
+                    ),
+            )
+        g_triage.add_argument( '--team_size',
+                type=int,
+                default=2,
+                help='Number of staff in each triage team (default: 2).',
+            )
         g_triage.add_argument( '--staff_file',
                 help='Override TRIAGE_STAFF_FILE environment variable.',
             )
+        g_triage.add_argument( '--pto_file',
+                help=(
+                    'Override TRIAGE_PTO_FILE environment variable.'
+                    '\nTeams with a member absent on a day are skipped for that day.'
+                    ),
+            )
         # Handoff Events
         g_handoff = parser.add_argument_group(
                 title='Handoff Events',
@@ -104,133 +274,492 @@ ENVIRONMENT VARIABLES:
         g_handoff.add_argument( '--mkhandoff', action='store_true',
                 help='Make or update triage handoff events using data from existing triage events.'
             )
+        # Plan / Apply
+        g_plan = parser.add_argument_group(
+                title='Plan and Apply',
+                description=(
+                    'Split --mktriage / --mkhandoff into two steps.'
+                    '\n--plan saves every create, update and no-op to a JSON file'
+                    '\nwithout changing the calendar.'
+                    '\n--apply executes a saved plan without fetching events'
+                    '\nor computing the schedule again.'
+                    ),
+            )
+        g_plan.add_argument( '--plan', metavar='OUTFILE',
+                help='Write the changes for --mktriage and/or --mkhandoff to OUTFILE.',
+            )
+        g_plan.add_argument( '--apply', metavar='INFILE',
+                help='Execute the changes in INFILE (written by --plan).',
+            )
+        g_plan.add_argument( '--resume', action='store_true',
+                help=(
+                    'Send the changes an interrupted run did not finish, as recorded'
+                    '\nin the journal next to the calendar cache, without computing'
+                    '\nthe schedule again (events still to create are looked up first).'
+                    ),
+            )
+        # Service
+        g_serve = parser.add_argument_group(
+                title='Service',
+                description=(
+                    'Keep running and reconcile --mktriage / --mkhandoff continuously.'
+                    '\nThe staff, holidays, PTO and location files are checked every'
+                    f'\n{FILE_POLL} seconds, a change reconciles all dates from START to END.'
+                    '\nThe calendar is checked every INTERVAL seconds, changed events'
+                    '\n(such as manual swaps in Outlook) reconcile only the dates they affect.'
+                    ),
+            )
+        g_serve.add_argument( '--serve', action='store_true',
+                help='Run as a service (requires the local calendar cache).',
+            )
+        g_serve.add_argument( '--interval',
+                type=int,
+                default=300,
+                help='Seconds between calendar checks with --serve (default: 300).',
+            )
 
         args = parser.parse_args()
         resources['args'] = args
 
         # set sane default for start
         if args.start:
-            # new_start = dateutil.parser.parse( args.start )
-            new_start = pandas.to_datetime( args.start )
-            args.start = new_start
+            args.start = libdate.parse_date( args.start )
         else:
             args.start = datetime.date.today()
 
         # set sane default for end
         if args.end:
-            # new_end = dateutil.parser.parse( args.end )
-            new_end = pandas.to_datetime( args.end )
-            args.end = new_end
+            args.end = libdate.parse_date( args.end )
         else:
             args.end = args.start + datetime.timedelta( days=90 )
     return resources['args']
 
 
 def get_regex_map():
+    ''' Regexes matching the subjects of TRIAGE and HANDOFF events (of the current group):
+        the group regex_map setting, else PYEXCH_REGEX_JSON (without --config),
+        else made from the subject prefix
+    '''
+    regex_map = get_setting( 'regex_map' )
+    if regex_map:
+        return regex_map
+    regex_json = os.getenv( 'PYEXCH_REGEX_JSON' )
+    if regex_json and current_group.get() is None:
+        try:
+            return json.loads( regex_json )
+        except ValueError as e:
+            raise UserWarning( f'PYEXCH_REGEX_JSON is not valid JSON: {e}' )
+    prefix = re.escape( get_setting( 'subject_prefix' ) )
     return {
-        "TRIAGE":"^Triage: ",
-        "HANDOFF":"^Triage Hand-Off",
+        "TRIAGE":f"^{prefix}: ",
+        "HANDOFF":f"^{prefix} Hand-Off",
         }
 
 
-def get_pyexch():
-    if 'pyexch' not in resources:
-        regex_map = get_regex_map()
-        resources['pyexch'] = pyexch.pyexch.PyExch( regex_map = regex_map )
-    return resources['pyexch']
+def get_subject( typ, members=() ):
+    ''' Subject of a new event of type typ (of the current group)
+        members = list of names, for TRIAGE events
+    '''
+    prefix = get_setting( 'subject_prefix' )
+    if typ == 'TRIAGE':
+        return f"{prefix}: {', '.join(members)}"
+    return f'{prefix} Hand-Off'
+
+
+def get_calendar_regex_map():
+    ''' Regexes for all events the calendar backend should return
+        With --config: the regexes of every group, with types "GROUP/TYPE"
+    '''
+    if not get_args().config:
+        return get_regex_map()
+    regex_map = {}
+    for group in get_groups():
+        with use_group( group ):
+            for typ, regex in get_regex_map().items():
+                regex_map[ f'{group.name}/{typ}' ] = regex
+    return regex_map
+
+
+def get_groups():
+    ''' List of libconfig.Groups from --config
+    '''
+    if 'groups' not in resources:
+        path = get_args().config
+        groups = libconfig.read_config( path )
+        events = {}
+        for group in groups:
+            with use_group( group ):
+                # any names will do in the triage subject
+                subjects = [ get_subject( 'TRIAGE', [ 'A', 'B' ] ), get_subject( 'HANDOFF' ) ]
+                events[group.name] = ( get_regex_map(), subjects )
+        libconfig.check_overlap( path, events )
+        resources['groups'] = groups
+    return resources['groups']
+
+
+@contextlib.contextmanager
+def use_group( group ):
+    ''' Settings and memoized data come from group inside the with block
+        (for the current thread only)
+    '''
+    token = current_group.set( group )
+    try:
+        yield group
+    finally:
+        current_group.reset( token )
+
+
+def group_resources():
+    ''' Hash for data that differs per group (resources itself without --config)
+    '''
+    group = current_group.get()
+    return resources if group is None else group.resources
+
+
+def get_setting( key ):
+    ''' Setting of the current group, else the command line value
+    '''
+    group = current_group.get()
+    if group is not None and group.settings.get( key ) is not None:
+        return group.settings[key]
+    return getattr( get_args(), key, None )
+
+
+def get_file_setting( key, env_name ):
+    ''' File name setting of the current group, else environment variable env_name,
+        else the command line value
+    '''
+    group = current_group.get()
+    if group is not None and group.settings.get( key ):
+        return group.settings[key]
+    return os.getenv( env_name, getattr( get_args(), key ) )
+
+
+def get_backend():
+    ''' The calendar (libbackend.Backend) selected with --backend
+    '''
+    if 'backend' not in resources:
+        args = get_args()
+        if args.backend == 'fake':
+            backend = libbackend.FakeBackend( get_calendar_regex_map() )
+        elif args.backend == 'ics':
+            if not args.ics_file:
+                raise UserWarning( 'Missing calendar file. Use --ics_file with --backend ics' )
+            backend = libbackend.IcsBackend( args.ics_file, get_calendar_regex_map() )
+        else:
+            backend = libbackend.PyExchBackend( get_calendar_regex_map() )
+        resources['backend'] = libmetrics.InstrumentedBackend( backend, get_metrics() )
+    return resources['backend']
+
+
+def get_metrics():
+    if 'metrics' not in resources:
+        resources['metrics'] = libmetrics.Metrics()
+    return resources['metrics']
+
+
+def count_retry( name ):
+    ''' on_retry callback for libpool.run_parallel(), counts retries of call "name"
+        (name may be a function of the item)
+    '''
+    metrics = get_metrics()
+    def on_retry( item, err ):
+        metrics.retry( name( item ) if callable( name ) else name )
+    return on_retry
+
+
+def write_metrics():
+    ''' Save the metrics of this run, if requested with --metrics / --metrics_textfile
+    '''
+    args = get_args()
+    metrics = get_metrics()
+    if args.metrics:
+        metrics.write_json( args.metrics, argv=sys.argv[1:] )
+        logging.info( f'Wrote metrics "{args.metrics}"' )
+    if args.metrics_textfile:
+        metrics.write_prometheus( args.metrics_textfile )
 
 
 def get_staff_data():
     ''' Read in the multi-purpose TRIAGE_STAFF_FILE
-        Reads the CSV file and stores a dict
+        Return libstaff.StaffRegistry
     '''
-    key = 'staffdata'
-    if key not in resources:
-        filename = os.getenv( 'TRIAGE_STAFF_FILE', get_args().staff_file )
+    key = 'staff_registry'
+    res = group_resources()
+    if key not in res:
+        filename = get_file_setting( 'staff_file', 'TRIAGE_STAFF_FILE' )
         if not filename:
             raise UserWarning( 'Missing staff file. Use --staff_file or TRIAGE_STAFF_FILE' )
-        df = pandas.read_csv( filename, sep=None, engine='python' )
-        resources[key] = { row.Name: row for row in df.itertuples() }
-    return resources[key]
+        with get_metrics().stage( 'staff_load' ):
+            res[key] = libstaff.get_registry( filename )
+    return res[key]
 
 
 def get_staff():
-    key = 'staff'
-    if key not in resources:
-        data = get_staff_data()
-        resources[key] = { k: v for k,v in data.items() if v.Type == 'staff' }
-    return resources[key]
+    return get_staff_data().staff
 
 
 def get_managers():
-    key = 'managers'
-    if key not in resources:
-        data = get_staff_data()
-        resources[key] = { k: v for k,v in data.items() if v.Type == 'manager' }
-    return resources[key]
+    return get_staff_data().managers
+
+
+def get_absences():
+    ''' List of ( name, start, end ) from the optional TRIAGE_PTO_FILE
+    '''
+    key = 'absences'
+    res = group_resources()
+    if key not in res:
+        filename = get_file_setting( 'pto_file', 'TRIAGE_PTO_FILE' )
+        res[key] = libsolve.read_absences( filename ) if filename else []
+    return res[key]
 
 
 def get_MODs( date ):
     ''' Given a date, return the Managers On Duty for that day
     '''
-    key = 'mod'
-    if key not in resources:
-        # Create a mapping of int-day-of-week -> Manager(s)
-        daychars = ( 'M', 'T', 'W', 'R', 'F', )
-        resources[key] = [ [], [], [], [], [], ]
-        for name,mgr in get_managers().items():
-            for dow_char in mgr.DOW:
-                dow_int = daychars.index( dow_char )
-                resources[ key ][ dow_int ].append( mgr )
-    # do the lookup
-    return resources[ key ][ date.weekday() ]
+    return get_staff_data().mods[ date.weekday() ]
+
 
+def get_MOD_emails():
+    ''' Tuple of Manager On Duty emails for each weekday (index = date.weekday())
+    '''
+    return get_staff_data().mod_emails
 
 
 def get_triage_location():
-    if 'triage_location' not in resources:
-        l_file = os.getenv( 'TRIAGE_LOCATION_FILE', get_args().location_file )
+    res = group_resources()
+    if 'triage_location' not in res:
+        l_file = get_file_setting( 'location_file', 'TRIAGE_LOCATION_FILE' )
         if not l_file:
             raise UserWarning( 'Missing location file. Use --location_file or TRIAGE_LOCATION_FILE' )
         p = pathlib.Path( l_file )
         location = p.read_text()
         if len(location) < 1:
             raise UserWarning( f"Unable to read location from file '{l_file}'" )
-        resources['triage_location'] = location
-    return resources['triage_location']
+        res['triage_location'] = location
+    return res['triage_location']
 
 
 def get_triage_categories():
-    if 'triage_categories' not in resources:
-        resources['triage_categories'] = [ 'TicketMaster' ]
-    return resources['triage_categories']
+    res = group_resources()
+    if 'triage_categories' not in res:
+        res['triage_categories'] = list( get_setting( 'categories' ) or [ 'TicketMaster' ] )
+    return res['triage_categories']
 
 
-def get_existing_events():
+def get_state_suffix():
+    ''' Part of the local state file names (cache, hashes, journal) that keeps
+        runs seeing the calendar differently apart: the backend, the --config
+        file and a digest of the event regexes (see get_calendar_regex_map())
+    '''
+    args = get_args()
+    suffix = ''
+    if args.backend != 'exchange':
+        # keep other calendars out of the exchange cache
+        suffix += f'-{args.backend}'
+    if args.config:
+        # event types are "GROUP/TYPE" with --config
+        suffix += f'-{pathlib.Path( args.config ).stem}'
+    regexes = json.dumps( get_calendar_regex_map(), sort_keys=True )
+    return f'{suffix}-{hashlib.sha1( regexes.encode() ).hexdigest()[:8]}'
+
+
+def get_cache_file():
+    default = pathlib.Path.home() / '.cache' / 'asd-triage-scheduler' / 'events.json'
+    path = pathlib.Path( os.getenv( 'TRIAGE_CACHE_FILE', default ) )
+    return path.with_name( f'{path.stem}{get_state_suffix()}{path.suffix}' )
+
+
+def get_hash_store():
+    ''' Desired state hashes, stored next to the calendar cache
+    '''
+    key = 'hash_store'
+    if key not in resources:
+        path = get_cache_file().with_name( f'hashes{get_state_suffix()}.json' )
+        resources[key] = libplan.HashStore( path )
+    return resources[key]
+
+
+def get_journal_file():
+    return get_cache_file().with_name( f'journal{get_state_suffix()}.jsonl' )
+
+
+def get_journal():
+    ''' Journal of the calendar changes of this run (libjournal.Journal),
+        started on first use. None with --dryrun or --serve
+        (--serve reconciles again after a failure anyway).
+    '''
+    args = get_args()
+    if args.dryrun or args.serve:
+        return None
+    key = 'journal'
+    with resources_lock:
+        if key not in resources:
+            journal = libjournal.Journal( get_journal_file() )
+            journal.open( resume=args.resume )
+            resources[key] = journal
+    return resources[key]
+
+
+def get_event_cache():
+    ''' The local calendar cache (libcache.EventCache), loaded once per process
+    '''
+    key = 'event_cache'
+    if key not in resources:
+        cache = libcache.EventCache( get_cache_file(), get_calendar_regex_map() )
+        if not get_args().refresh:
+            cache.load()
+        resources[key] = cache
+    return resources[key]
+
+
+def sync_event_cache():
+    ''' Download calendar changes into the local cache
+        Return list of changed events, see libcache.EventCache.sync()
+    '''
+    cache = get_event_cache()
+    changed = cache.sync( get_backend() )
+    cache.save()
+    return changed
+
+
+def get_synced_event_cache():
+    ''' The local calendar cache, synced with the calendar once per run
+        (with --serve, serve() syncs it before each reconcile)
+    '''
+    key = 'event_cache_synced'
+    if key not in resources:
+        if not get_args().serve:
+            sync_event_cache()
+        resources[key] = True
+    return get_event_cache()
+
+
+def fetch_existing_events():
     ''' Get existing events between "start" and "end"
         start = datetime.date
         end = datetime.date
+        Return list of libstore.EventRecords
     '''
-    start = get_args().start
-    end = get_args().end
-    logging.debug( pprint.pformat( [ start, end ] ) )
-    px = get_pyexch()
-    # ensure end is 11:59:59 PM
-    existing_events = px.get_events_filtered(
+    args = get_args()
+    if args.no_cache:
+        return fetch_existing_events_from_exchange()
+    existing_events = get_synced_event_cache().events_between( args.start, args.end )
+    for e in existing_events:
+        logging.debug( f'{e.start} {e.type} {e.subject}' )
+    return existing_events
+
+
+def fetch_window( window ):
+    ''' Get existing events from the calendar for one window
+        window = ( start, end ) datetime.date tuple (inclusive)
+        Return list of libstore.EventRecords starting in the window
+    '''
+    start, end = window
+    logging.debug( f'Fetch window {start} .. {end}' )
+    events = get_backend().fetch(
         start = datetime.datetime( start.year, start.month, start.day ),
-        end = datetime.datetime( end.year, end.month, end.day, hour=11, minute=59, second=59 ),
+        end = datetime.datetime( end.year, end.month, end.day, hour=23, minute=59, second=59 ),
     )
-    # logging.debug( f'Existing events: { [ (e.start, e.type, e.subject) for e in existing_events ] }' )
+    # drop events that only overlap the window, the neighbouring window owns them
+    return [ e for e in events if start <= e.date <= end ]
+
+
+def fetch_existing_events_from_exchange():
+    ''' Get existing events from exchange between "start" and "end"
+        The range is split into --fetch_window sized windows,
+        fetched up to --jobs at a time.
+        Return list of libstore.EventRecords
+    '''
+    existing_events = []
+    for events in fetch_windows():
+        existing_events.extend( events )
     for e in existing_events:
         logging.debug( f'{e.start} {e.type} {e.subject}' )
-    # create hash of event dates & types
-    current_events = {}
-    for e in existing_events:
-        dt = e.start.date()
-        if dt not in current_events:
-            current_events[dt] = {}
-        current_events[dt][e.type] = e
-    return current_events
+    return existing_events
+
+
+def fetch_windows():
+    ''' Fetch existing events from the calendar in --fetch_window sized windows,
+        up to --jobs at a time.
+        Yield list of libstore.EventRecords for each window, in date order
+    '''
+    args = get_args()
+    backend = get_backend()
+    windows = libdate.split_range( args.start, args.end, args.fetch_window )
+    logging.debug( pprint.pformat( windows ) )
+    if args.jobs > 1:
+        backend.set_max_connections( args.jobs )
+    results = libpool.iter_parallel( fetch_window, windows, args.jobs,
+        retry_on = backend.throttle_errors(),
+        on_retry = count_retry( 'backend.fetch' ),
+    )
+    for window, rv in results:
+        if isinstance( rv, Exception ):
+            logging.error( f'Failed to fetch events for {window[0]} .. {window[1]}' )
+            raise rv
+        yield rv
+
+
+def iter_existing_events():
+    ''' Existing events between "start" and "end", in chunks as they arrive
+        (one chunk per window with --no_cache, else a single chunk)
+        Yield lists of libstore.EventRecords sorted by start
+    '''
+    args = get_args()
+    if current_group.get() is None and args.no_cache:
+        for events in fetch_windows():
+            yield sorted( events, key=lambda e: e.start )
+    else:
+        events = [ e for sub in get_existing_events().values() for e in sub.values() ]
+        yield sorted( events, key=lambda e: e.start )
+
+
+def load_existing_events():
+    with get_metrics().stage( 'fetch' ):
+        return fetch_existing_events()
+
+
+def get_all_events():
+    ''' Existing events of all groups, fetched once and shared by the groups
+        Return list of libstore.EventRecords with types "GROUP/TYPE"
+    '''
+    with resources_lock:
+        if 'all_events' not in resources:
+            resources['all_events'] = load_existing_events()
+    return resources['all_events']
+
+
+def load_group_events():
+    ''' Existing events of the current group, with the group name removed from the type
+    '''
+    prefix = f'{current_group.get().name}/'
+    events = []
+    for e in get_all_events():
+        if e.type.startswith( prefix ):
+            typ = e.type[ len( prefix ): ]
+            events.append( libstore.EventRecord( e.start, typ, e.subject, e.attendees, e.item_id, e.changekey, e.state_hash ) )
+    return events
+
+
+def get_event_store():
+    ''' Events are fetched from exchange once per process and shared by all modes.
+        Use get_event_store().invalidate() or .refresh() to force a new fetch.
+    '''
+    key = 'event_store'
+    res = group_resources()
+    if key not in res:
+        loader = load_existing_events if current_group.get() is None else load_group_events
+        res[key] = libstore.EventStore( loader=loader )
+    return res[key]
+
+
+def get_existing_events():
+    ''' Existing events between "start" and "end",
+        including any created or updated by this process.
+        Return dict with keys=DATE and values={ TYPE: event }
+    '''
+    return get_event_store().by_date()
 
 
 def validate_user_input():
@@ -248,57 +777,57 @@ def validate_user_input():
         logging.debug( f"MKHANDOFF" )
 
 
-def create_triage_meetings( mtg_data ):
-    ''' Use mtg_data to create meetings iff they don't already exist
+def plan_triage_meetings( mtg_data, existing_events ):
+    ''' Use mtg_data to plan meetings iff they don't already exist
         mtg_data = {
-            datetime: {
+            date: {
                 'emails': list of email addrs,
                 'members': Names of attendees,
             }
         )
+        existing_events = dict with keys=DATE and values={ TYPE: event }
+        Return list of ops (see libplan)
     '''
-    # get existing events
-    args = get_args()
-    existing_events = get_existing_events()
-    # try to create events for dates from csv
-    for dt, data in mtg_data.items():
-        try:
-            # dt is a datetime, use just the date component to match existing event
-            ev = existing_events[dt.date()]['TRIAGE']
-        except KeyError:
-            ev = None
-        create_or_update_triage_event(
-            date = dt,
-            emails = data['emails'],
-            members = data['members'],
-            existing_event = ev
-        )
+    ops = []
+    with get_metrics().stage( 'plan_triage' ):
+        for dt, data in mtg_data.items():
+            try:
+                ev = existing_events[ libplan.to_date( dt ) ]['TRIAGE']
+            except KeyError:
+                ev = None
+            ops.append( plan_triage_event(
+                date = dt,
+                emails = data['emails'],
+                members = data['members'],
+                existing_event = ev
+            ) )
+    return ops
 
 
-def create_or_update_triage_event( date, emails, members, existing_event=None ):
-    ''' date = datetime for new event
+def plan_triage_event( date, emails, members, existing_event=None ):
+    ''' date = date for new event
         emails = list of email addresses
         members = list of names (used in the event title)
-        existing_event = raw exchange event
+        existing_event = libstore.EventRecord
+        Return a "create" op, or a "noop" if there is an existing event
+        (existing events are kept, to allow manual swaps in Outlook)
     '''
     if existing_event:
         logging.info( f'Found existing TRIAGE event for date "{date}"' )
-        #logging.debug( f'Existing Event: {existing_event}' )
-    else:
-        subj = f"Triage: {', '.join(members)}"
-        logging.info( f'Making new TRIAGE event for date "{date}"' )
-        args = get_args()
-        if args.dryrun:
-            logging.info( f'DRYRUN: Subj:"{subj}" Attendees:"{emails}"' )
-        else:
-            get_pyexch().new_all_day_event(
-                date = date,
-                subject = subj,
-                attendees = emails,
-                location = get_triage_location(),
-                categories = get_triage_categories(),
-                free = True,
-            )
+        return libplan.mk_noop( 'TRIAGE', date, existing_event )
+    subj = get_subject( 'TRIAGE', members )
+    logging.info( f'Making new TRIAGE event for date "{date}"' )
+    return libplan.mk_create_op(
+        typ = 'TRIAGE',
+        date = date,
+        subject = subj,
+        start = date,
+        attendees = emails,
+        location = get_triage_location(),
+        categories = get_triage_categories(),
+        all_day = True,
+        free = True,
+    )
 
 
 def events_by_type( types ):
@@ -321,97 +850,324 @@ def events_by_type( types ):
 
 def meeting_attendees( event ):
     ''' Get a list of emails for all meeting attendees from event,
-        where event is a "simple_event" from pyexch
+        where event is a libstore.EventRecord
     '''
-    #   Required_attendees=[ Attendee(), ...]
-    #     where Attendee( mailbox=Mailbox(), ...)
-    #     and where Mailbox( email_address='...', ...)
-    #     thus, emails=[ a.mailbox.email_address for a in required_attendees ]
-    return [ a.mailbox.email_address for a in event.raw_event.required_attendees ]
+    return list( event.attendees )
 
 
-def create_handoff_meetings():
-    args = get_args()
+def plan_handoff_meetings( existing_events, prev_members=None ):
+    ''' existing_events = dict with keys=DATE and values={ TYPE: event }
+        prev_members = see handoff_states()
+        Return list of ops (see libplan)
+    '''
+    return [
+        plan_handoff_event( date, list( emails ), existing_events[ date ].get( 'HANDOFF' ) )
+        for date, emails in handoff_states( existing_events, prev_members )
+    ]
 
-    # Get all existing TRIAGE & HANDOFF events from Exchange calendar
-    existing_events = get_existing_events()
-    # For each day there is a TRIAGE event,
-    #   get the required_attendees from both this and the next TRIAGE event
-    triage_dates = sorted( existing_events.keys() )
-    loop_end = len( triage_dates ) - 1
-    for i in range( loop_end ):
-        # get members from current triage event
-        curr_date = triage_dates[i]
-        curr_triage_event = existing_events[ curr_date ][ 'TRIAGE' ]
-        curr_members = meeting_attendees( curr_triage_event )
-        logging.debug( f'{curr_triage_event.start} {curr_triage_event.subject}, {curr_members}' )
-        # get members from next triage event
-        try:
-            next_date = triage_dates[i+1]
-        except KeyError:
-            logging.error( f'Next date not found, after curr_date: "{curr_date}"' )
-            raise
-        try:
-            next_triage_event = existing_events[ next_date ][ 'TRIAGE' ]
-            next_members = meeting_attendees( next_triage_event )
-        except KeyError:
-            logging.error( f'No event data found after date: "{curr_date}"' )
-            raise
-        except TypeError:
-            logging.error( f'Are there Required Attendees for the triage meeting on "{next_date}"?' )
-            raise
-        handoff_date = next_date
-        managers_on_duty = [ m.Email for m in get_MODs( handoff_date ) ]
-        logging.debug( f'MODs for {handoff_date}: {managers_on_duty}' )
-        handoff_members = curr_members + next_members + managers_on_duty
-        logging.debug( f'Calculated handoff data: {handoff_date} {handoff_members}' )
-        # get existing handoff event, if it exists
-        try:
-            handoff_event = existing_events[ handoff_date ][ 'HANDOFF' ]
-        except KeyError:
-            handoff_event = None
-        create_or_update_handoff_event( handoff_date, handoff_members, handoff_event )
+
+def handoff_states( existing_events, prev_members=None ):
+    ''' Desired HANDOFF attendees, in one pass over the dates:
+        on each triage date (after the first), the members of the previous
+        and the current TRIAGE event and the managers on duty.
+        Dates without a TRIAGE event are skipped and reported.
+        existing_events = dict with keys=DATE and values={ TYPE: event }
+        prev_members = attendees of the TRIAGE event before the first date,
+                       if known (the first date then gets a HANDOFF too)
+        Return list of ( date, tuple of emails ) in date order
+    '''
+    mod_emails = get_MOD_emails()
+    states = []
+    for date in sorted( existing_events ):
+        triage_event = existing_events[ date ].get( 'TRIAGE' )
+        if triage_event is None:
+            logging.warning( f'No TRIAGE event on "{date}", skipping HANDOFF for that date' )
+            continue
+        members = triage_event.attendees
+        if prev_members is not None:
+            states.append( ( date, prev_members + members + mod_emails[ date.weekday() ] ) )
+        prev_members = members
+    return states
 
 
-def create_or_update_handoff_event( date, emails, existing_event=None ):
+def plan_handoff_event( date, emails, existing_event=None ):
     ''' date = date of the event
         emails = list of email addresses
-        existing_event = raw exchange event
+        existing_event = libstore.EventRecord
+        Return a "create" op, an "update" op if the existing event has
+        different members, or a "noop"
     '''
-    args = get_args()
     if existing_event:
         logging.info( f'Found existing HANDOFF event for date "{date}"' )
-        #logging.debug( f'Existing Event: {existing_event}' )
+        desired_hash = libplan.state_hash( 'HANDOFF', date, emails )
+        hashes = get_hash_store()
+        if hashes.is_current( existing_event, desired_hash ):
+            logging.debug( f'Unchanged HANDOFF event for date "{date}"' )
+            return libplan.mk_noop( 'HANDOFF', date, existing_event )
         existing_members = sorted( meeting_attendees( existing_event ) )
         new_members = sorted( emails )
-        if existing_members != new_members:
-            logging.debug( f'Member mismatch for HANDOFF date "{date}"' )
-            logging.debug( f'Existing: "{existing_members}"' )
-            logging.debug( f'New:      "{new_members}"' )
-            msg = f'Updated member list for HANDOFF date "{date}"'
-            if args.dryrun:
-                logging.info( f'DRYRUN: {msg}' )
-            else:
-                px = get_pyexch()
-                px.update_event( existing_event.raw_event, attendees=new_members )
-                logging.info( msg )
+        if existing_members == new_members:
+            hashes.put( existing_event.item_id, desired_hash, existing_event.changekey )
+            return libplan.mk_noop( 'HANDOFF', date, existing_event )
+        logging.debug( f'Member mismatch for HANDOFF date "{date}"' )
+        logging.debug( f'Existing: "{existing_members}"' )
+        logging.debug( f'New:      "{new_members}"' )
+        return libplan.mk_update_op(
+            typ = 'HANDOFF',
+            date = date,
+            event = existing_event,
+            attendees = new_members,
+        )
+    subj = get_subject( 'HANDOFF' )
+    ev_start = datetime.datetime.combine( date,  datetime.time( hour=8, minute=45 ) )
+    ev_end = datetime.datetime.combine( date, datetime.time( hour=9, minute=00 ) )
+    logging.info( f'Making new HANDOFF event for date "{date}"' )
+    return libplan.mk_create_op(
+        typ = 'HANDOFF',
+        date = date,
+        subject = subj,
+        start = ev_start,
+        end = ev_end,
+        attendees = emails,
+        location = get_triage_location(),
+        categories = get_triage_categories(),
+    )
+
+
+def describe_op( op ):
+    if op['action'] == 'update':
+        return f'Updated member list for {op["type"]} date "{op["date"]}"'
+    if op['all_day']:
+        return f'Subj:"{op["subject"]}" Attendees:"{op["attendees"]}"'
+    return f'Start:"{op["start"]}" End:"{op["end"]}" Subj:"{op["subject"]}" Attendees:"{op["attendees"]}"'
+
+
+def apply_plan( ops ):
+    ''' Execute the "create" and "update" ops (or just log them with --dryrun)
+        Return list of ops that failed
+    '''
+    try:
+        failed = apply_ops( ops )
+    finally:
+        # also keep what was done before an error, the journal says it is done
+        if not get_args().dryrun:
+            get_backend().flush()
+        get_hash_store().save()
+    return failed
+
+
+def apply_ops( ops ):
+    ''' apply_plan() without saving the calendar and the hashes
+    '''
+    changes = list( libplan.changes( ops ) )
+    if get_args().dryrun:
+        for op in changes:
+            logging.info( f'DRYRUN: {describe_op( op )}' )
+        return []
+    journal = get_journal()
+    if journal:
+        journal.planned( changes )
+    for op in changes:
+        submit_op( op )
+    return flush_ops()
+
+
+def mk_plan( dates=None ):
+    ''' Plan all changes for the selected modes (--mktriage, --mkhandoff)
+        Handoff planning takes the planned triage events into account.
+        dates = set of datetime.date to plan for (default: all from START to END)
+        Return list of ops
+    '''
+    args = get_args()
+    existing_events = get_existing_events()
+    ops = []
+    if args.mktriage:
+        schedule = mk_triage_schedule()
+        if dates is not None:
+            schedule = { day: data for day, data in schedule.items() if day in dates }
+        ops.extend( plan_triage_meetings( schedule, existing_events ) )
+    if args.mkhandoff:
+        with get_metrics().stage( 'plan_handoff' ):
+            handoff_ops = plan_handoff_meetings( libplan.overlay( existing_events, ops ) )
+        if dates is not None:
+            handoff_ops = [ op for op in handoff_ops if op['date'] in dates ]
+        ops.extend( handoff_ops )
+    get_hash_store().save()
+    return ops
+
+
+def execute_op( op ):
+    ''' Send a single create or update op to the calendar
+    '''
+    return get_backend().execute( op )
+
+
+def queue_ops():
+    ''' True if ops are collected and sent by flush_ops(),
+        False if each op is executed as soon as it is submitted
+    '''
+    args = get_args()
+    return args.batch_size > 0 or args.jobs > 1
+
+
+def submit_op( op ):
+    ''' Execute op now, or queue it for flush_ops() if --batch_size or --jobs is set
+    '''
+    if queue_ops():
+        resources.setdefault( 'pending_ops', [] ).append( op )
+    else:
+        finish_op( op, execute_op( op ) )
+
+
+def finish_op( op, result ):
+    ''' Record the result of an op the calendar accepted
+        result = ( item_id, changekey ) if known
+    '''
+    logging.info( f'Finished {op["action"]} {op["type"]} event for date "{op["date"]}"' )
+    get_event_store().apply( op, result )
+    if isinstance( result, tuple ):
+        get_hash_store().put( result[0], op.get( 'hash' ), result[1] )
+    journal = get_journal()
+    if journal:
+        journal.done( op, result )
+
+
+def write_batch( ops ):
+    return get_backend().write_batch( ops )
+
+
+def flush_ops():
+    ''' Send all queued ops to the calendar, in chunks of --batch_size (if set),
+        running up to --jobs requests in parallel.
+        Report the result of each op; a failed op does not stop the others.
+        Return list of ops that failed
+    '''
+    ops = resources.pop( 'pending_ops', [] )
+    if not ops:
+        return []
+    args = get_args()
+    backend = get_backend()
+    if args.jobs > 1:
+        backend.set_max_connections( args.jobs )
+    retry_on = backend.throttle_errors()
+    results = []
+    if args.batch_size > 0:
+        batches = list( libpool.chunks( ops, args.batch_size ) )
+        on_retry = count_retry( 'backend.write_batch' )
+        for batch, rv in libpool.run_parallel( write_batch, batches, args.jobs, retry_on=retry_on, on_retry=on_retry ):
+            if isinstance( rv, Exception ):
+                # whole request failed, report it for every op in the batch
+                rv = [ ( op, rv ) for op in batch ]
+            results.extend( rv )
     else:
-        subj = 'Triage Hand-Off'
-        ev_start = datetime.datetime.combine( date,  datetime.time( hour=8, minute=45 ) )
-        ev_end = datetime.datetime.combine( date, datetime.time( hour=9, minute=00 ) )
-        logging.info( f'Making new HANDOFF event for date "{date}"' )
-        if args.dryrun:
-            logging.info( f'DRYRUN: Start:"{ev_start}" End:"{ev_end}" Subj:"{subj}" Attendees:"{emails}"' )
+        on_retry = count_retry( lambda op: f'backend.{op["action"]}' )
+        results = libpool.run_parallel( execute_op, ops, args.jobs, retry_on=retry_on, on_retry=on_retry )
+    failed = []
+    for op, result in results:
+        if isinstance( result, Exception ):
+            logging.error( f'Failed to {op["action"]} {op["type"]} event for date "{op["date"]}": {result}' )
+            failed.append( op )
+            journal = get_journal()
+            if journal:
+                journal.failed( op, result )
         else:
-            px = get_pyexch()
-            px.new_event(
-                start = ev_start,
-                end = ev_end,
-                subject = subj,
-                attendees = emails,
-                location = get_triage_location(),
-                categories = get_triage_categories()
+            finish_op( op, result )
+    if failed:
+        logging.warning( f'{len(failed)} of {len(ops)} calendar changes failed' )
+    return failed
+
+
+def drop_existing_creates( ops ):
+    ''' Leave out "create" ops whose event is in the calendar already
+        (sent just before a failure, but not marked done in the journal),
+        and mark them done. Only the dates of the create ops are fetched.
+        Return the other ops
+    '''
+    dates = [ op['date'] for op in ops if op['action'] == 'create' ]
+    if not dates:
+        return ops
+    with get_metrics().stage( 'fetch' ):
+        events = fetch_window( ( min( dates ), max( dates ) ) )
+    found = { ( e.subject, e.start ): e for e in events }
+    journal = get_journal()
+    rv = []
+    for op in ops:
+        e = found.get( ( op['subject'], op['start'] ) ) if op['action'] == 'create' else None
+        if e is None:
+            rv.append( op )
+            continue
+        logging.info( f'Found {op["type"]} event for date "{op["date"]}" already created' )
+        if journal:
+            journal.done( op, ( e.item_id, e.changekey ) )
+    return rv
+
+
+def run_pipeline():
+    ''' --mktriage / --mkhandoff one chunk of dates (--fetch_window) at a time,
+        fetching, planning and applying different chunks at the same time
+        (see libpipeline). Plans the same changes as mk_plan().
+        Return list of ops that failed
+    '''
+    args = get_args()
+    backend = get_backend()
+    # create these before the stage threads need them
+    get_hash_store()
+    if args.jobs > 1:
+        backend.set_max_connections( args.jobs )
+    if not args.no_cache:
+        get_synced_event_cache()
+    if args.continue_rotation:
+        # reads the synced cache, work it out before the stage threads start
+        get_continue_at()
+    windows = libdate.split_range( args.start, args.end, args.fetch_window )
+    # planning state carried from one chunk to the next
+    carry = { 'schedule': None, 'prev_members': None }
+
+    def fetch( window ):
+        if not args.no_cache:
+            return get_event_cache().events_between( *window )
+        with get_metrics().stage( 'fetch' ):
+            ( _, rv ), = libpool.run_parallel( fetch_window, [ window ], 1,
+                retry_on = backend.throttle_errors(),
+                on_retry = count_retry( 'backend.fetch' ),
             )
+        if isinstance( rv, Exception ):
+            logging.error( f'Failed to fetch events for {window[0]} .. {window[1]}' )
+            raise rv
+        return rv
+
+    def plan( window, events ):
+        start, end = window
+        existing_events = {}
+        for e in events:
+            existing_events.setdefault( e.date, {} )[ e.type ] = e
+        ops = []
+        if args.mktriage:
+            if carry['schedule'] is None:
+                carry['schedule'] = mk_triage_schedule()
+            schedule = { day: data for day, data in carry['schedule'].items() if start <= libplan.to_date( day ) <= end }
+            ops.extend( plan_triage_meetings( schedule, existing_events ) )
+        if args.mkhandoff:
+            planned = libplan.overlay( existing_events, ops )
+            with get_metrics().stage( 'plan_handoff' ):
+                ops.extend( plan_handoff_meetings( planned, carry['prev_members'] ) )
+            triage_dates = [ d for d, sub in planned.items() if 'TRIAGE' in sub ]
+            if triage_dates:
+                carry['prev_members'] = planned[ max( triage_dates ) ]['TRIAGE'].attendees
+        logging.info( f'Plan {start} .. {end}: {libplan.summary( ops )}' )
+        return ops
+
+    def apply( window, ops ):
+        failed = apply_ops( ops )
+        get_hash_store().save()
+        return failed
+
+    try:
+        results = libpipeline.run_pipeline( windows, [ fetch, plan, apply ], PIPELINE_DEPTH )
+    finally:
+        if not args.dryrun:
+            backend.flush()
+    return [ op for failed in results for op in failed ]
 
 
 def mk_triage_schedule():
@@ -420,62 +1176,342 @@ def mk_triage_schedule():
         values = { 'emails': emails, 'members': members }
     '''
     staff = get_staff()
+    emails = get_staff_data().emails
+    metrics = get_metrics()
     triage_teams = get_triage_teams()
-    logging.debug( f'starting length triage_teams: {len(triage_teams)}' )
+    logging.debug( f'length triage_teams: {len(triage_teams)}' )
     args = get_args()
-    workdays = list( libdate.get_workdays( args.start, args.end ) )
+    with metrics.stage( 'workdays' ):
+        workdays = libdate.get_workdays( args.start, args.end )
     logging.debug( f'num workdays: {len(workdays)}' )
-    # ensure triage_teams is longer than workdays
-    scalar = int( len(workdays) / len(triage_teams) ) + 1
-    logging.debug( f'Scalar: {scalar}' )
-    triage_teams *= scalar
-    logging.debug( f'new length triage_teams: {len(triage_teams)}' )
+    people = list( staff.keys() )
+    with metrics.stage( 'teams' ):
+        available = libsolve.availability_bitmap( people, workdays, get_absences() )
+        assignments = libsolve.assign_teams( triage_teams, workdays, people, available )
     # create the data
     triage_raw_data = {}
-    for day in workdays:
-        # TODO - add checks here to skip if someone is on PTO or has a PM
-        members = triage_teams.popleft()
-        emails = [ staff[x].Email for x in members ]
-        triage_raw_data[day] = { 'emails': emails, 'members': members }
+    for day, members in assignments:
+        triage_raw_data[day] = { 'emails': [ emails[x] for x in members ], 'members': members }
     return triage_raw_data
 
 
 def get_triage_teams():
+    ''' Rotation of triage teams (libgroup.FairTeams), starting at --start_at
+        (or where --continue finds it)
+    '''
     staff = get_staff()
-    teamlist = libgroup.fair_pairs( list( staff.keys() ) )
-    teams = collections.deque( teamlist )
-    teams.rotate( -(get_args().start_at) )
-    return teams
+    if get_args().continue_rotation:
+        offset = get_continue_at()
+    else:
+        offset = get_setting( 'start_at' )
+    return libgroup.FairTeams( list( staff.keys() ), k=get_setting( 'team_size' ), offset=offset )
 
 
-def run():
-    validate_user_input()
+def get_events_before_start():
+    ''' Existing events of the current group in the CONTINUE_LOOKBACK days before START
+        Return list of libstore.EventRecords sorted by start
+    '''
+    args = get_args()
+    window = ( args.start - datetime.timedelta( days=CONTINUE_LOOKBACK ), args.start - datetime.timedelta( days=1 ) )
+    if args.no_cache:
+        with get_metrics().stage( 'fetch' ):
+            events = fetch_window( window )
+    else:
+        events = get_synced_event_cache().events_between( *window )
+    group = current_group.get()
+    prefix = f'{group.name}/' if group else ''
+    events = [ e for e in events if e.type.startswith( prefix ) ]
+    return sorted( events, key=lambda e: e.start )
+
+
+def get_continue_at():
+    ''' Rotation index after the team of the latest TRIAGE event before START
+        (--start_at for --continue)
+    '''
+    key = 'continue_at'
+    res = group_resources()
+    if key not in res:
+        group = current_group.get()
+        typ = f'{group.name}/TRIAGE' if group else 'TRIAGE'
+        events = [ e for e in get_events_before_start() if e.type == typ ]
+        if not events:
+            raise UserWarning(
+                f'No TRIAGE event in the {CONTINUE_LOOKBACK} days before {get_args().start},'
+                ' cannot --continue. Use --start_at'
+            )
+        teams = libgroup.FairTeams( list( get_staff().keys() ), k=get_setting( 'team_size' ) )
+        index = teams.team_index()
+        names = { email.lower(): name for name, email in get_staff_data().emails.items() }
+        found = [ frozenset( names.get( a.lower(), a ) for a in e.attendees ) for e in events ]
+        # where the rotation should be now, from the latest event with a rotation team
+        near = None
+        for n, team in enumerate( reversed( found ) ):
+            if team in index:
+                near = ( index[team] + n ) % len( teams )
+                break
+        latest = events[-1]
+        i = teams.nearest_index( found[-1], near )
+        if i is None:
+            raise UserWarning( f'TRIAGE event "{latest.subject}" on {latest.date} has no members from the staff file' )
+        if found[-1] in index:
+            logging.info( f'Continue after team {i} {teams[i]} of {latest.date}' )
+        else:
+            logging.warning( f'Team of {latest.date} "{latest.subject}" is not in the rotation, continue after the nearest team {i} {teams[i]}' )
+        res[key] = ( i + 1 ) % len( teams )
+    return res[key]
+
+
+def affected_dates( events, existing_events ):
+    ''' Dates whose planned events may depend on the changed events
+        (a TRIAGE event is also part of the handoff on the next triage date)
+        events = list of libstore.EventRecords
+        existing_events = dict with keys=DATE and values={ TYPE: event }
+        Return set of datetime.date
+    '''
+    triage_dates = sorted( d for d, sub in existing_events.items() if 'TRIAGE' in sub )
+    dates = set()
+    for e in events:
+        dates.add( e.date )
+        if e.type == 'TRIAGE':
+            i = bisect.bisect_right( triage_dates, e.date )
+            if i < len( triage_dates ):
+                dates.add( triage_dates[i] )
+    return dates
+
+
+def reset_inputs( names ):
+    ''' Forget cached input data for the changed files (see INPUT_KEYS)
+    '''
+    for name in names:
+        for key in INPUT_KEYS[name]:
+            resources.pop( key, None )
+
+
+def reconcile( dates=None ):
+    ''' Plan and apply the changes for dates (all from START to END if None)
+    '''
+    args = get_args()
+    if dates is None:
+        logging.info( 'Reconcile all dates' )
+    else:
+        dates = { d for d in dates if args.start <= d <= args.end }
+        if not dates:
+            return
+        logging.info( f'Reconcile {len(dates)} dates: {", ".join( str( d ) for d in sorted( dates ) )}' )
+    ops = mk_plan( dates )
+    logging.info( f'Plan: {libplan.summary( ops )}' )
+    apply_plan( ops )
+
+
+def serve():
+    ''' Reconcile all dates, then keep reconciling the dates affected by
+        changes to the input files or the calendar, until interrupted
+    '''
+    args = get_args()
+    if args.no_cache:
+        raise UserWarning( '--serve needs the local calendar cache, remove --no_cache' )
+    watcher = libwatch.FileWatcher( {
+        'staff': os.getenv( 'TRIAGE_STAFF_FILE', args.staff_file ),
+        'holidays': os.getenv( 'TRIAGE_HOLIDAYS_FILE' ),
+        'pto': os.getenv( 'TRIAGE_PTO_FILE', args.pto_file ),
+        'location': os.getenv( 'TRIAGE_LOCATION_FILE', args.location_file ),
+    } )
+    full = True
+    next_check = 0
+    while True:
+        changed_files = watcher.changed()
+        if changed_files:
+            reset_inputs( changed_files )
+            full = True
+        if changed_files or time.monotonic() >= next_check:
+            next_check = time.monotonic() + args.interval
+            try:
+                changed_events = sync_event_cache()
+                get_event_store().invalidate()
+                dates = None if full else affected_dates( changed_events, get_existing_events() )
+                reconcile( dates )
+                full = False
+            except Exception as e:
+                # keep serving, try all dates again at the next check
+                logging.exception( f'Reconcile failed: {e}' )
+                full = True
+            write_metrics()
+        time.sleep( FILE_POLL )
+
 
+def list_teams():
+    teams = get_triage_teams()
+    for i,members in enumerate( teams ):
+        print( f'{i: >2d} {members}' )
+    if get_args().debug:
+        for name, ( lo, mean ) in teams.recurrence_stats().items():
+            logging.debug( f'{name}: min distance {lo}, mean distance {mean:.1f}' )
+
+
+def triage_report():
+    fmt = get_args().report_format
+    if fmt != 'text':
+        chunks = ( [ e for e in events if e.type == 'TRIAGE' ] for events in iter_existing_events() )
+        write = libreport.write_jsonl if fmt == 'jsonl' else libreport.write_csv
+        count = write( chunks, sys.stdout )
+        logging.info( f'Reported {count} triage events' )
+        return
+    events = events_by_type( types=('TRIAGE',) )
+    for date, sub in events.items():
+        print( f'{date}' )
+        for typ, ev in sub.items():
+            print( f'\t{typ}' )
+            members = meeting_attendees( ev )
+            print( f'\t\t{ev.start} {ev.type} {ev.subject} {members}' )
+
+
+def fairness_report():
+    args = get_args()
+    if args.report_format not in ( 'text', 'jsonl' ):
+        raise UserWarning( '--fairness_report supports --report_format text or jsonl' )
+    events = [ e for chunk in iter_existing_events() for e in chunk ]
+    registry = get_staff_data()
+    calendar = libdate.get_work_calendar()
+    report = libreport.fairness(
+        triage_events = [ e for e in events if e.type == 'TRIAGE' ],
+        handoff_events = [ e for e in events if e.type == 'HANDOFF' ],
+        people = registry.staff.keys(),
+        teams = get_triage_teams(),
+        emails = registry.emails,
+        managers = registry.managers.keys(),
+        workday_index = lambda days: calendar.count( args.start, days ) - 1,
+    )
+    if args.report_format == 'jsonl':
+        libreport.write_fairness_jsonl( report, sys.stdout )
+    else:
+        libreport.write_fairness_text( report, sys.stdout )
+
+
+def plan_group( group ):
+    ''' mk_plan() for one --config group
+        Return list of ops, each with the group name in op['group']
+    '''
+    with use_group( group ):
+        logging.info( f'Planning group "{group.name}"' )
+        ops = mk_plan()
+    for op in ops:
+        op['group'] = group.name
+    return ops
+
+
+def run_groups():
+    ''' Run the selected modes for each group in --config
+        Groups are planned in parallel, then the changes are applied one group at a time.
+    '''
     args = get_args()
+    if args.serve or args.pipeline:
+        raise UserWarning( '--serve and --pipeline do not support --config' )
+    groups = get_groups()
 
-    if args.list_teams:
-        for i,members in enumerate( get_triage_teams() ):
-            print( f'{i: >2d} {members}' )
+    if args.list_teams or args.triage_report or args.fairness_report:
+        for group in groups:
+            if args.report_format == 'text':
+                print( f'[{group.name}]' )
+            with use_group( group ):
+                if args.list_teams:
+                    list_teams()
+                elif args.triage_report:
+                    triage_report()
+                else:
+                    fairness_report()
         return True
 
-    if args.triage_report:
-        events = events_by_type( types=('TRIAGE',) )
-        for date, sub in events.items():
-            print( f'{date}' )
-            for typ, ev in sub.items():
-                print( f'\t{typ}' )
-                members = meeting_attendees( ev )
-                print( f'\t\t{ev.start} {ev.type} {ev.subject} {members}' )
+    for group in groups:
+        with use_group( group ):
+            validate_user_input()
+    # shared by all groups, create them before the planning threads need them
+    get_backend()
+    get_hash_store()
+    if args.continue_rotation:
+        for group in groups:
+            with use_group( group ):
+                get_continue_at()
+    all_ops = []
+    ops_by_group = []
+    for group, rv in libpool.run_parallel( plan_group, groups, len( groups ), retry_on=() ):
+        if isinstance( rv, Exception ):
+            logging.error( f'Failed to plan group "{group.name}"' )
+            raise rv
+        logging.info( f'Group "{group.name}": {libplan.summary( rv )}' )
+        all_ops.extend( rv )
+        ops_by_group.append( ( group, rv ) )
+
+    if args.plan:
+        libplan.write_plan( args.plan, all_ops, start=args.start, end=args.end, config=args.config )
+        logging.info( f'Wrote plan "{args.plan}": {libplan.summary( all_ops )}' )
         return True
 
-    if args.mktriage:
-        logging.info( f"make triage schedule" )
-        triage_raw_data = mk_triage_schedule()
-        logging.debug( f'Triage raw data: {triage_raw_data}' )
-        create_triage_meetings( triage_raw_data )
+    journal = get_journal()
+    if journal:
+        # all groups, so that --resume can finish the groups not reached
+        journal.planned( list( libplan.changes( all_ops ) ) )
+    for group, ops in ops_by_group:
+        with use_group( group ):
+            apply_plan( ops )
+    return True
 
-    if args.mkhandoff:
-        create_handoff_meetings()
+
+def run():
+    args = get_args()
+
+    # offline and read-only commands don't need the location file
+    if args.list_teams and not args.config:
+        list_teams()
+        return True
+
+    if args.triage_report and not args.config:
+        triage_report()
+        return True
+
+    if args.fairness_report and not args.config:
+        fairness_report()
+        return True
+
+    if args.resume:
+        ops = libjournal.Journal( get_journal_file() ).read()
+        if not ops:
+            logging.info( f'Nothing to resume in "{get_journal_file()}"' )
+            return True
+        logging.info( f'Resume "{get_journal_file()}": {libplan.summary( ops )}' )
+        apply_plan( drop_existing_creates( ops ) )
+        return True
+
+    if args.apply:
+        ops = libplan.read_plan( args.apply )
+        logging.info( f'Apply plan "{args.apply}": {libplan.summary( ops )}' )
+        apply_plan( ops )
+        return True
+
+    if args.config:
+        return run_groups()
+
+    validate_user_input()
+
+    if args.serve:
+        serve()
+        return True
+
+    if args.plan:
+        ops = mk_plan()
+        libplan.write_plan( args.plan, ops, start=args.start, end=args.end )
+        logging.info( f'Wrote plan "{args.plan}": {libplan.summary( ops )}' )
+        return True
+
+    if args.pipeline and ( args.mktriage or args.mkhandoff ):
+        run_pipeline()
+        return True
+
+    if args.mktriage or args.mkhandoff:
+        # plan everything before the first change, so that the journal
+        # holds all the changes of the run (see --resume)
+        ops = mk_plan()
+        logging.info( f'Plan: {libplan.summary( ops )}' )
+        apply_plan( ops )
 
 
 if __name__ == '__main__':
@@ -493,4 +1529,7 @@ if __name__ == '__main__':
     ]
     for key in no_debug:
         logging.getLogger(key).setLevel(logging.CRITICAL)
-    run()
+    try:
+        run()
+    finally:
+        write_metrics()
@@ -0,0 +1,25 @@
+#!/bin/env python3
+
+import pytest
+
+import libconfig
+
+
+def prefix_events( prefix ):
+    regex_map = { 'TRIAGE': f'^{prefix}: ', 'HANDOFF': f'^{prefix} Hand-Off' }
+    return ( regex_map, [ f'{prefix}: A, B', f'{prefix} Hand-Off' ] )
+
+
+def test_check_overlap_distinct_prefixes():
+    libconfig.check_overlap( 'cfg.yaml', { 'asd': prefix_events( 'Triage' ), 'ops': prefix_events( 'Ops Triage' ) } )
+
+
+def test_check_overlap_same_prefix():
+    with pytest.raises( UserWarning, match='same event regex' ):
+        libconfig.check_overlap( 'cfg.yaml', { 'asd': prefix_events( 'Triage' ), 'ops': prefix_events( 'Triage' ) } )
+
+
+def test_check_overlap_regex_matches_other_group():
+    loose = ( { 'TRIAGE': 'Triage: ', 'HANDOFF': 'Triage Hand-Off' }, [ 'Triage: A, B', 'Triage Hand-Off' ] )
+    with pytest.raises( UserWarning, match='"Ops Triage: A, B" of group "ops" matches the TRIAGE regex of group "asd"' ):
+        libconfig.check_overlap( 'cfg.yaml', { 'asd': loose, 'ops': prefix_events( 'Ops Triage' ) } )
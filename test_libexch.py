@@ -0,0 +1,45 @@
+#!/bin/env python3
+
+import datetime
+
+import exchangelib
+
+import libexch
+import libplan
+
+
+def mk_account():
+    ''' exchangelib Account that is never connected, with no calendar folder
+    '''
+    config = exchangelib.Configuration(
+        service_endpoint = 'https://localhost/EWS/Exchange.asmx',
+        credentials = exchangelib.Credentials( 'user', 'password' ),
+        auth_type = exchangelib.NTLM,
+        version = exchangelib.Version( build=exchangelib.Build( 15, 1 ) ),
+    )
+    account = exchangelib.Account( 'triage@example.com', config=config, autodiscover=False,
+            default_timezone=exchangelib.EWSTimeZone( 'UTC' ) )
+    # the calendar folder is looked up on the server on first use
+    account.__dict__['calendar'] = None
+    return account
+
+
+def test_mk_calendar_item_all_day():
+    day = datetime.date( 2024, 1, 2 )
+    op = libplan.mk_create_op( 'TRIAGE', day, 'Triage: A, B', day, [ 'a@example.com' ], '', [ 'Triage' ],
+            all_day=True, free=True )
+    item = libexch.mk_calendar_item( mk_account(), op )
+    assert item.is_all_day
+    assert item.start == exchangelib.EWSDate( 2024, 1, 2 )
+    assert item.end == exchangelib.EWSDate( 2024, 1, 3 )
+
+
+def test_mk_calendar_item_timed():
+    day = datetime.date( 2024, 1, 2 )
+    start = datetime.datetime( 2024, 1, 2, 9, 0 )
+    op = libplan.mk_create_op( 'HANDOFF', day, 'Triage Handoff', start, [ 'a@example.com' ], 'Zoom', [],
+            end=start + datetime.timedelta( minutes=30 ) )
+    item = libexch.mk_calendar_item( mk_account(), op )
+    assert not item.is_all_day
+    assert item.start.hour == 9
+    assert item.end.minute == 30
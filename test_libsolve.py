@@ -0,0 +1,47 @@
+#!/bin/env python3
+
+import datetime
+
+import libgroup
+import libsolve
+
+
+def weekdays( start, end ):
+    days = ( start + datetime.timedelta( days=i ) for i in range( ( end - start ).days + 1 ) )
+    return [ d for d in days if d.weekday() < 5 ]
+
+
+def test_assign_teams_long_absence():
+    people = [ 'A', 'B', 'C', 'D', 'E', 'F' ]
+    workdays = weekdays( datetime.date( 2024, 1, 1 ), datetime.date( 2024, 12, 31 ) )
+    away = ( datetime.date( 2024, 2, 1 ), datetime.date( 2024, 5, 31 ) )
+    bitmap = libsolve.availability_bitmap( people, workdays, [ ( 'A', *away ) ] )
+    assignments = libsolve.assign_teams( libgroup.FairTeams( people, 2 ), workdays, people, bitmap )
+    assert [ day for day, _ in assignments ] == workdays
+    assert not [ day for day, team in assignments if 'A' in team and away[0] <= day <= away[1] ]
+    # A is back in the rotation afterwards
+    assert [ day for day, team in assignments if 'A' in team and day > away[1] ]
+
+
+def test_assign_teams_no_absences():
+    people = [ 'A', 'B', 'C', 'D' ]
+    teams = libgroup.FairTeams( people, 2 )
+    workdays = weekdays( datetime.date( 2024, 1, 1 ), datetime.date( 2024, 1, 31 ) )
+    bitmap = libsolve.availability_bitmap( people, workdays, [] )
+    assignments = libsolve.assign_teams( teams, workdays, people, bitmap )
+    assert [ team for _, team in assignments ] == [ teams[i] for i in range( len( workdays ) ) ]
+
+
+def test_assign_teams_skipped_team_goes_next():
+    people = [ 'A', 'B', 'C', 'D', 'E', 'F' ]
+    teams = libgroup.FairTeams( people, 2 )
+    workdays = weekdays( datetime.date( 2024, 1, 1 ), datetime.date( 2024, 1, 10 ) )
+    # A out on the first day, D on the fourth
+    absences = [ ( 'A', workdays[0], workdays[0] ), ( 'D', workdays[3], workdays[3] ) ]
+    bitmap = libsolve.availability_bitmap( people, workdays, absences )
+    assignments = libsolve.assign_teams( teams, workdays, people, bitmap )
+    assert [ team for _, team in assignments ] == [
+        ( 'B', 'E' ), ( 'A', 'D' ), ( 'C', 'F' ),
+        # ( 'B', 'D' ) is blocked, ( 'B', 'E' ) has been off duty longest
+        ( 'B', 'E' ), ( 'B', 'D' ), ( 'C', 'E' ), ( 'A', 'F' ), ( 'C', 'D' ),
+    ]